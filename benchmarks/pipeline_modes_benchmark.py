@@ -0,0 +1,89 @@
+"""
+Benchmark of the two chain and the structured single call email pipeline modes.
+
+Runs the LLM stage of both modes over the recorded domains in benchmarks/data/email_domains.json and reports the
+latency per domain, the token usage and how often the majority pattern matches the expected one. The local rule
+engine, cache and batching are bypassed so every domain hits the LLM. Needs OPENAI_API_KEY (or OPENAI_API_BASE
+pointing to an OpenAI compatible server).
+
+Usage:
+    python -m benchmarks.pipeline_modes_benchmark [--repeats 3] [--dataset benchmarks/data/email_domains.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+from langchain.callbacks import get_openai_callback
+
+from src.email_processor.email_processor import EmailProcesssor
+
+DATASET_PATH = os.path.join(os.path.dirname(__file__), "data", "email_domains.json")
+
+
+async def run_mode(mode: str, dataset: dict, repeats: int, cache_dir: str):
+    """
+    Runs the LLM stage of a pipeline mode over every domain of the dataset.
+
+    Returns:
+        dict: The latencies in seconds, the token usage, and the pattern found for every domain.
+    """
+    processor = EmailProcesssor({
+        "openAI_model_name": "gpt-3.5-turbo-1106",
+        "debug": False,
+        "email_pipeline_mode": mode,
+        "cache_path": os.path.join(cache_dir, f"{mode}.sqlite3"),
+    })
+    latencies = []
+    patterns = {}
+    with get_openai_callback() as cb:
+        for _ in range(repeats):
+            for domain, entry in dataset.items():
+                emails = processor._generic_filter.filter(entry["emails"])
+                start = time.perf_counter()
+                codes = await processor._classify_with_llm(emails)
+                latencies.append(time.perf_counter() - start)
+                votes = Counter(code for code in codes.values() if code is not None)
+                patterns[domain] = votes.most_common(1)[0][0] if votes else None
+    return {"latencies": latencies, "prompt_tokens": cb.prompt_tokens, "completion_tokens": cb.completion_tokens,
+            "patterns": patterns}
+
+
+def percentile(values: list, fraction: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    args = parser.parse_args()
+
+    with open(args.dataset, encoding="utf-8") as f:
+        dataset = json.load(f)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for mode in ("two_chain", "structured"):
+            results[mode] = asyncio.run(run_mode(mode, dataset, args.repeats, cache_dir))
+
+    for mode, result in results.items():
+        latencies = result["latencies"]
+        correct = sum(result["patterns"][domain] == entry["expected"] for domain, entry in dataset.items())
+        print(f"{mode}:")
+        print(f"  latency per domain: mean {statistics.mean(latencies):.2f}s, p50 {percentile(latencies, 0.5):.2f}s, "
+              f"p95 {percentile(latencies, 0.95):.2f}s")
+        print(f"  tokens: {result['prompt_tokens']} prompt, {result['completion_tokens']} completion")
+        print(f"  expected pattern found for {correct}/{len(dataset)} domains")
+
+    agreement = sum(results["two_chain"]["patterns"][domain] == results["structured"]["patterns"][domain] for domain in dataset)
+    print(f"modes agree on {agreement}/{len(dataset)} domains")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Report of the prompt tokens of the second email chain with the whole few-shot library and with the selected examples.
+
+Usage:
+    python -m benchmarks.prompt_tokens_report [--dataset benchmarks/data/email_domains.json] [--k 2]
+"""
+import argparse
+import json
+import os
+
+from src.email_processor.few_shot import FewShotSelector
+from src.email_processor.prompts import second_prompt, second_prompt_examples
+from src.utils import count_tokens
+
+DATASET_PATH = os.path.join(os.path.dirname(__file__), "data", "email_domains.json")
+
+
+def prompt_tokens(emails: list, examples: str):
+    """
+    Counts the tokens of the second chain's prompt.
+    """
+    messages = second_prompt.format_messages(emails="\n".join(emails), examples=examples)
+    return sum(count_tokens(message.content) for message in messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--k", type=int, default=2)
+    args = parser.parse_args()
+
+    with open(args.dataset, encoding="utf-8") as f:
+        dataset = json.load(f)
+
+    selector = FewShotSelector(second_prompt_examples, k=args.k)
+    all_examples = selector.format(second_prompt_examples)
+    total_before = total_after = 0
+    print(f"{'domain':<24}{'emails':>8}{'before':>10}{'after':>10}")
+    for domain, entry in dataset.items():
+        before = prompt_tokens(entry["emails"], all_examples)
+        after = prompt_tokens(entry["emails"], selector.format(selector.select(entry["emails"])))
+        total_before += before
+        total_after += after
+        print(f"{domain:<24}{len(entry['emails']):>8}{before:>10}{after:>10}")
+    print(f"{'total':<24}{'':>8}{total_before:>10}{total_after:>10}  ({1 - total_after / total_before:.0%} fewer tokens)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Record/replay benchmark of the email pattern and translation pipelines.
+
+In record mode, runs the email domains and job titles datasets through EmailProcesssor and Translator against the
+live API (or OPENAI_API_BASE) and records every completion in a transcript corpus. In replay mode, runs the same
+datasets with every completion served from the corpus by prompt hash, offline and without rate limits, so changes to
+parsing, post-processing and orchestration can be timed at full speed. Both modes write the outputs as sorted JSON,
+so the outputs of a change can be diffed byte for byte against the recorded ones.
+
+Caches start empty on every run and small domain batching is off, since batches depend on timing and a different
+batch is a different prompt. A prompt missing from the corpus fails like an API error would, and is counted.
+
+Usage:
+    python -m benchmarks.replay_benchmark record --corpus transcripts/benchmark.jsonl.gz --output recorded.json
+    python -m benchmarks.replay_benchmark replay --corpus transcripts/benchmark.jsonl.gz --output replayed.json [--repeats 5]
+    diff recorded.json replayed.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from src.email_processor.email_processor import EmailProcesssor
+from src.translator.translator import Translator
+from src.llm_client import get_llm_pool
+from src.metrics import LLM_ERRORS
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+async def run_once(settings: dict, domains: dict, titles: dict):
+    """
+    Runs both datasets through fresh processors.
+
+    Returns:
+        dict: The pattern of every domain and the translated titles of every company.
+    """
+    email_processor = EmailProcesssor(settings)
+    translator = Translator(settings)
+    patterns = await email_processor.process_domains({domain: entry["emails"] for domain, entry in domains.items()})
+    translations = await asyncio.gather(*(translator.translate(company, list(company_titles)) for company, company_titles in titles.items()))
+    await get_llm_pool(settings).close()
+    return {"email_patterns": patterns, "translations": dict(zip(titles, translations))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--corpus", default="transcripts/benchmark.jsonl.gz")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--domains", default=os.path.join(DATA_DIR, "email_domains.json"))
+    parser.add_argument("--titles", default=os.path.join(DATA_DIR, "job_titles.json"))
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.domains, encoding="utf-8") as f:
+        domains = json.load(f)
+    with open(args.titles, encoding="utf-8") as f:
+        titles = json.load(f)
+
+    durations = []
+    for _ in range(args.repeats if args.mode == "replay" else 1):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            settings = {
+                "openAI_model_name": "gpt-3.5-turbo-1106",
+                "debug": False,
+                "batch_small_domains": False,
+                "cache_path": os.path.join(cache_dir, "analysis_cache.sqlite3"),
+                "llm_transcript_mode": args.mode,
+                "llm_transcript_path": args.corpus,
+            }
+            start = time.perf_counter()
+            outputs = asyncio.run(run_once(settings, domains, titles))
+            durations.append(time.perf_counter() - start)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(outputs, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    print(f"{args.mode}: {len(domains)} domains and {len(titles)} companies, mean {statistics.mean(durations):.3f}s "
+          f"over {len(durations)} runs, {LLM_ERRORS.total():g} failed LLM calls")
+    print(f"outputs written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Offline OpenAI compatible stub server for benchmarks.
+
+Answers /v1/chat/completions with canned answers shaped like the real answers to the prompts of this repository
+(email chains, batched and structured email prompts, translation, domain recognition and summarization), after a
+latency drawn from a configurable distribution. Rate limit errors (429) and timeouts (a long wait ending in a 504)
+can be injected at random, and a script file can override the answer of any prompt. GET /stats returns the number
+of requests, injected errors and tokens served.
+
+Usage:
+    python -m benchmarks.stub_openai_server [--port 8765] [--latency lognormal:0.8,0.4] [--per-token-latency 0.002]
+        [--rate-429 0.05] [--rate-timeout 0.01] [--timeout-seconds 20] [--script script.json] [--seed 0]
+
+Latency distributions: fixed:SECONDS, uniform:LOW,HIGH, lognormal:MEDIAN,SIGMA.
+A script is a JSON list of {"match": regex, "response": text, "status": code} entries. The first entry whose regex
+matches the prompt gives the answer; entries with a status other than 200 return that error instead.
+
+Point the service at it with OPENAI_API_BASE=http://localhost:8765/v1 and any OPENAI_API_KEY.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class StubBehaviour:
+    """
+    The latency, fault injection and scripted answers of the stub.
+    """
+    def __init__(self, latency: str = "fixed:0", per_token_latency: float = 0.0, rate_429: float = 0.0,
+                 rate_timeout: float = 0.0, timeout_seconds: float = 20.0, script: list = None, seed: int = 0):
+        kind, _, params = latency.partition(":")
+        self.latency_kind = kind
+        self.latency_params = [float(param) for param in params.split(",") if param != ""]
+        self.per_token_latency = per_token_latency
+        self.rate_429 = rate_429
+        self.rate_timeout = rate_timeout
+        self.timeout_seconds = timeout_seconds
+        self.script = [(re.compile(entry["match"], re.DOTALL), entry) for entry in (script or [])]
+        self.random = random.Random(seed)
+        self.stats = Counter()
+
+    def latency(self, completion_tokens: int):
+        """
+        Draws the number of seconds to wait before answering.
+        """
+        if self.latency_kind == "uniform":
+            base = self.random.uniform(*self.latency_params)
+        elif self.latency_kind == "lognormal":
+            median, sigma = self.latency_params
+            base = self.random.lognormvariate(math.log(median), sigma)
+        else:
+            base = self.latency_params[0] if self.latency_params else 0.0
+        return base + self.per_token_latency * completion_tokens
+
+
+def _email_structure(email: str):
+    """
+    Describes the structure of an email the way chain two does, from the shape of its local part.
+    """
+    local_part, _, domain = email.partition("@")
+    tokens = [token for token in re.split(r"[._-]", local_part) if token != ""]
+    separators = re.findall(r"[._-]", local_part)
+    if len(tokens) == 1:
+        return f"[first name]@{domain}"
+    first = "[first name initial (1 initial)]" if len(tokens[0]) == 1 else "[first name]"
+    return f"{first}{separators[0] if separators else ''}[last name]@{domain}"
+
+
+def _pattern_answer(emails: list):
+    """
+    Answers chain two for a list of emails.
+    """
+    if len(emails) == 0:
+        return "Most frequently repeated email structure: NONE"
+    structures = [_email_structure(email) for email in emails]
+    analysis = "\n\n".join(f"-Email address: {email}\n-Email structure: {structure}" for email, structure in zip(emails, structures))
+    return (f"Individual email analysis one by one:\n{analysis}\n\n"
+            f"Most frequently repeated email structure: {Counter(structures).most_common(1)[0][0]}")
+
+
+def _emails_in(text: str):
+    return re.findall(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+", text)
+
+
+def canned_answer(prompt: str):
+    """
+    Builds an answer shaped like the real answer to a prompt of this repository.
+
+    Args:
+        prompt (str): The text of every message of the request.
+
+    Returns:
+        str: The answer.
+    """
+    if "JSON answer:" in prompt:
+        emails = _emails_in(prompt.split("Input emails:")[-1])
+        structures = [{"email": email, "structure": _email_structure(email)} for email in emails]
+        majority = Counter(entry["structure"] for entry in structures).most_common(1)
+        return json.dumps({"personal_emails": emails, "structures": structures,
+                           "majority_pattern": majority[0][0] if majority else "NONE"})
+    if "Input sections:" in prompt:
+        sections = re.findall(r"=== DOMAIN (\d+) ===\n(.*?)\n=== END DOMAIN \1 ===", prompt.split("Input sections:")[-1], re.DOTALL)
+        if "Individual email analysis" in prompt:
+            return "\n\n".join(f"=== DOMAIN {number} ===\n{_pattern_answer(_emails_in(text))}" for number, text in sections)
+        return "\n\n".join(f"=== DOMAIN {number} ===\n" + "\n".join(_emails_in(text)) for number, text in sections)
+    if "Input emails: ```" in prompt:
+        return "\n".join(_emails_in(prompt.split("Input emails: ```")[-1].split("```")[0])) or "NONE"
+    if "Most frequently repeated email structure" in prompt:
+        return _pattern_answer(_emails_in(prompt.split("###")[-2]))
+    if "Translated titles" in prompt:
+        titles = re.findall(r"^\[(\d+)\] (.*)$", prompt.split("```")[-2], re.MULTILINE)
+        return "\n".join(f"[{title_id}] {title}" for title_id, title in titles)
+    if "pick one domain" in prompt:
+        domains = prompt.split("```")[-2].strip().splitlines()
+        return domains[0].strip() if domains else "NONE"
+    if "Sections:" in prompt:
+        headings = re.findall(r"^\d+\. .*$", prompt.split("Sections:")[-1], re.MULTILINE)
+        return "\n".join(f"{heading}\n- stub information" for heading in headings)
+    return "OK"
+
+
+def create_app(behaviour: StubBehaviour):
+    """
+    Creates the stub application.
+
+    Args:
+        behaviour (StubBehaviour): The latency, fault injection and scripted answers.
+
+    Returns:
+        FastAPI: The application.
+    """
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        behaviour.stats["requests"] += 1
+
+        draw = behaviour.random.random()
+        if draw < behaviour.rate_429:
+            behaviour.stats["injected_429"] += 1
+            return JSONResponse({"error": {"message": "Rate limit reached (injected by the stub)", "type": "requests"}},
+                                status_code=429, headers={"retry-after": "1"})
+        if draw < behaviour.rate_429 + behaviour.rate_timeout:
+            behaviour.stats["injected_timeouts"] += 1
+            await asyncio.sleep(behaviour.timeout_seconds)
+            return JSONResponse({"error": {"message": "Upstream timed out (injected by the stub)", "type": "server_error"}},
+                                status_code=504)
+
+        status, answer = 200, None
+        for pattern, entry in behaviour.script:
+            if pattern.search(prompt):
+                status, answer = entry.get("status", 200), entry.get("response", "")
+                break
+        if answer is None:
+            answer = canned_answer(prompt)
+
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(answer) // 4 + 1
+        await asyncio.sleep(behaviour.latency(completion_tokens))
+        if status != 200:
+            behaviour.stats[f"scripted_{status}"] += 1
+            return JSONResponse({"error": {"message": answer, "type": "scripted"}}, status_code=status)
+
+        behaviour.stats["prompt_tokens"] += prompt_tokens
+        behaviour.stats["completion_tokens"] += completion_tokens
+        return {
+            "id": f"chatcmpl-stub-{behaviour.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return dict(behaviour.stats)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:0.8,0.4")
+    parser.add_argument("--per-token-latency", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-timeout", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=20.0)
+    parser.add_argument("--script", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    script = None
+    if args.script is not None:
+        with open(args.script, encoding="utf-8") as f:
+            script = json.load(f)
+
+    import uvicorn
+    behaviour = StubBehaviour(args.latency, args.per_token_latency, args.rate_429, args.rate_timeout,
+                              args.timeout_seconds, script, args.seed)
+    uvicorn.run(create_app(behaviour), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+End-to-end throughput benchmark against the offline OpenAI stub server.
+
+Starts benchmarks/stub_openai_server.py, serves the API of main.py in process, and drives POST /find_email_pattern
+and the Translator, DomainRecognizer and Summarizer code paths at every concurrency level. Every request has its own
+inputs, so the caches and in-flight coalescing do not hide the work. Reports throughput and p50/p95/p99 latency per
+scenario and concurrency level, and compares them with a saved baseline: a throughput drop or a p95 increase beyond
+the tolerance counts as a regression and makes the run exit with status 1.
+
+The stub answers after a simulated latency, so the numbers measure the service's own overhead and concurrency rather
+than the model. The rate limiter quotas are lifted for the same reason, pass --rpm/--tpm to benchmark them too.
+
+--save-baseline only replaces the scenarios that ran, and refuses to save if a requested scenario was skipped or had
+errors, so a scenario whose calls fail can never become the baseline. Without network access the tiktoken
+encodings cannot be loaded and token counts fall back to an estimate, see count_tokens.
+
+Usage:
+    python -m benchmarks.throughput_benchmark [--concurrency 1 8 32] [--requests 48] [--latency lognormal:0.3,0.3]
+        [--scenarios email_pattern translation domain_recognition summarization] [--save-baseline] [--tolerance 0.25]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+BASELINE_PATH = os.path.join(DATA_DIR, "throughput_baseline.json")
+SCENARIOS = ["email_pattern", "translation", "domain_recognition", "summarization"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(port: int, args):
+    """
+    Starts the stub server in a subprocess and waits until it answers.
+    """
+    command = [sys.executable, "-m", "benchmarks.stub_openai_server", "--port", str(port), "--latency", args.latency,
+               "--rate-429", str(args.rate_429), "--seed", str(args.seed)]
+    process = subprocess.Popen(command, cwd=REPO_DIR)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The stub server did not start")
+
+
+def percentile(values: list, fraction: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def load_inputs():
+    """
+    Loads the email domains and job titles the requests are built from.
+    """
+    with open(os.path.join(DATA_DIR, "email_domains.json"), encoding="utf-8") as f:
+        domains = json.load(f)
+    with open(os.path.join(DATA_DIR, "job_titles.json"), encoding="utf-8") as f:
+        titles = json.load(f)
+    return domains, titles
+
+
+def build_requests(scenario: str, count: int, domains: dict, titles: dict, tag: str):
+    """
+    Builds the arguments of `count` requests of a scenario. The tag and the request number are part of every input,
+    so no two requests share inputs.
+    """
+    requests = []
+    domain_items = list(domains.items())
+    title_items = list(titles.items())
+    for i in range(count):
+        if scenario == "email_pattern":
+            payload = {}
+            for j in range(3):
+                domain, entry = domain_items[(i + j) % len(domain_items)]
+                unique_domain = f"{tag}-{i}-{domain}"
+                payload[unique_domain] = [email.replace(domain, unique_domain) for email in entry["emails"]]
+            requests.append(payload)
+        elif scenario == "translation":
+            company, company_titles = title_items[i % len(title_items)]
+            requests.append((f"{company} {tag}-{i}", list(company_titles)))
+        elif scenario == "domain_recognition":
+            requests.append(([f"Company {tag}-{i}"], [f"company{tag}-{i}.com", f"company{tag}-{i}-group.de", "gmail.com"]))
+        else:
+            text = " ".join(f"Company {tag}-{i} produces steel coils and wire rods at plant {j}." for j in range(40))
+            requests.append((text, f"Company {tag}-{i}", ["production sites", "product range"]))
+    return requests
+
+
+async def run_level(call, requests: list, concurrency: int):
+    """
+    Runs requests with at most `concurrency` of them in flight.
+
+    Returns:
+        dict: The throughput in requests per second, the latency percentiles in seconds and the number of errors.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def run_one(request):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if not await call(request):
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_one(request) for request in requests))
+    elapsed = time.perf_counter() - start
+    return {"throughput": len(requests) / elapsed, "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99), "errors": errors}
+
+
+async def run_benchmarks(args, stub_port: int):
+    """
+    Serves the API in process and runs every scenario at every concurrency level.
+    """
+    import aiohttp
+    import uvicorn
+
+    #The first call creates the shared limiter and pool, so these settings win over the ones in main.py
+    from src.rate_limiter import get_rate_limiter
+    get_rate_limiter({"openai_requests_per_minute": args.rpm, "openai_tokens_per_minute": args.tpm,
+                      "llm_initial_concurrency": 1024, "llm_max_concurrency": 1024})
+    import main
+    from src.translator.translator import Translator
+    from src.domain_recognizer.domain_recognizer import DomainRecognizer
+
+    api_port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=api_port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    domains, titles = load_inputs()
+    results = {}
+    async with aiohttp.ClientSession() as session:
+        async def find_email_pattern(payload):
+            async with session.post(f"http://127.0.0.1:{api_port}/find_email_pattern", json=payload) as response:
+                return response.status == 200 and len(await response.json()) == len(payload)
+
+        calls = {"email_pattern": find_email_pattern}
+        if "translation" in args.scenarios:
+            #Titles repeat across requests, so the translation memory is scoped to the unique company of every request
+            translator = Translator({**main.setup_dict, "translation_memory_per_company": True})
+            calls["translation"] = lambda request: translator.translate(*request, raise_errors=True)
+        if "domain_recognition" in args.scenarios:
+            recognizer = main.get_processor(DomainRecognizer)
+            calls["domain_recognition"] = lambda request: recognizer.recognize_company_domain(*request)
+        if "summarization" in args.scenarios:
+            try:
+                from src.summarizer.summarization_tool import Summarizer
+                summarizer = main.get_processor(Summarizer)
+                calls["summarization"] = lambda request: summarizer.process(*request, raise_errors=True)
+            except Exception as excep:
+                print(f"summarization: skipped, the summarizer could not be created ({excep})")
+
+        for scenario in args.scenarios:
+            if scenario not in calls:
+                continue
+            results[scenario] = {}
+            for concurrency in args.concurrency:
+                requests = build_requests(scenario, args.requests, domains, titles, f"c{concurrency}")
+                results[scenario][str(concurrency)] = await run_level(calls[scenario], requests, concurrency)
+
+    server.should_exit = True
+    await server_task
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    Compares results with a baseline.
+
+    Returns:
+        list: A description of every regression.
+    """
+    regressions = []
+    for scenario, levels in results.items():
+        for concurrency, result in levels.items():
+            base = baseline.get("results", {}).get(scenario, {}).get(concurrency)
+            if base is None:
+                continue
+            if result["throughput"] < base["throughput"] * (1 - tolerance):
+                regressions.append(f"{scenario} at concurrency {concurrency}: throughput {result['throughput']:.1f}/s "
+                                   f"vs baseline {base['throughput']:.1f}/s")
+            if result["p95"] > base["p95"] * (1 + tolerance):
+                regressions.append(f"{scenario} at concurrency {concurrency}: p95 {result['p95']:.2f}s vs baseline {base['p95']:.2f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=48, help="Requests per scenario and concurrency level")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--latency", default="lognormal:0.3,0.3", help="Latency distribution of the stub")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of stub answers that are 429 errors")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rpm", type=int, default=1000000)
+    parser.add_argument("--tpm", type=int, default=1000000000)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub = start_stub(stub_port, args)
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{stub_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+    sys.path.insert(0, REPO_DIR)
+    try:
+        #Caches and the job queue are created relative to the working directory, so every run starts empty
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.chdir(work_dir)
+            results = asyncio.run(run_benchmarks(args, stub_port))
+            os.chdir(REPO_DIR)
+        stub_stats = json.load(urllib.request.urlopen(f"http://127.0.0.1:{stub_port}/stats", timeout=5))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    for scenario, levels in results.items():
+        print(f"{scenario}:")
+        for concurrency, result in levels.items():
+            print(f"  concurrency {concurrency:>3}: {result['throughput']:7.1f} req/s, p50 {result['p50']:.3f}s, "
+                  f"p95 {result['p95']:.3f}s, p99 {result['p99']:.3f}s, errors {result['errors']}")
+    print(f"stub served {stub_stats.get('requests', 0)} LLM requests")
+
+    settings = {"latency": args.latency, "rate_429": args.rate_429, "requests": args.requests}
+    if args.save_baseline:
+        incomplete = [scenario for scenario in args.scenarios
+                      if scenario not in results or any(result["errors"] > 0 for result in results[scenario].values())]
+        if incomplete:
+            print(f"baseline not saved, {incomplete} skipped or had errors")
+            sys.exit(1)
+        #Keep the scenarios that did not run, as long as they were recorded with the same settings
+        saved_results = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+            if baseline.get("settings") == settings:
+                saved_results = baseline.get("results", {})
+        saved_results.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": saved_results}, f, indent=2)
+        print(f"baseline saved to {args.baseline} with {list(results)} updated")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != settings:
+            print(f"baseline was recorded with {baseline.get('settings')}, not comparing")
+            return
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("no regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
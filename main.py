@@ -1,8 +1,20 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Match
 
 
 from src.email_processor.email_processor import EmailProcesssor
+from src.translator.translator import Translator
+from src.domain_recognizer.domain_recognizer import DomainRecognizer
+from src.job_queue.job_queue import JobQueue
+from src.job_queue.worker_pool import JobWorkerPool
+from src.llm_client import get_llm_pool
 from src.logger import logging
+from src.metrics import REGISTRY, HTTP_IN_FLIGHT, HTTP_LATENCY
+
+import json
+import time
+import asyncio
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -11,18 +23,132 @@ app = FastAPI()
 
 setup_dict = {
     "openAI_model_name": "gpt-3.5-turbo-1106",
-    "debug": True
+    "debug": True,
+    "max_concurrent_domains": 20,
+    "batch_small_domains": True,
+    "email_pipeline_mode": "two_chain",
+    "job_queue_path": "cache/jobs.sqlite3",
+    "job_workers": 20,
+    "openai_requests_per_minute": 3500,
+    "openai_tokens_per_minute": 90000,
+    "llm_max_concurrency": 64,
+    # Model parameters per "module.stage", e.g. {"email_processor.chain_two": {"model_name": "gpt-4-1106-preview"}}
+    "llm_overrides": {},
+    # "record" appends every completion to llm_transcript_path, "replay" serves completions from it without the API
+    "llm_transcript_mode": None,
+    "llm_transcript_path": "transcripts/llm_transcripts.jsonl.gz"
 }
 
 logging.info("Initializing Email processor")
 email_processor = EmailProcesssor(setup_dict)
 
+# The other processors are only needed by batch jobs, so they are created on first use.
+processors = {}
+
+def get_processor(processor_class):
+    if processor_class not in processors:
+        logging.info(f"Initializing {processor_class.__name__}")
+        processors[processor_class] = processor_class(setup_dict)
+    return processors[processor_class]
+
+async def summarize(company_name, payload):
+    # Imported here since the summarizer pulls in the vector store dependencies.
+    from src.summarizer.summarization_tool import Summarizer
+    return await get_processor(Summarizer).process(payload["text"], company_name, payload["keywords"], raise_errors=True)
+
+# Every job type maps to a coroutine that processes one item of the job given its key and payload. Handlers raise
+# their errors, so the worker pool retries the item and marks it failed after its last attempt.
+job_handlers = {
+    "email_pattern": lambda domain, emails: email_processor.process_emails(emails, domain, raise_errors=True),
+    "translation": lambda company_name, titles: get_processor(Translator).translate(company_name, titles, raise_errors=True),
+    "domain_recognition": lambda company_name, domains: get_processor(DomainRecognizer).recognize_company_domain([company_name], domains, raise_errors=True),
+    "summarization": summarize
+}
+
+job_queue = JobQueue(setup_dict["job_queue_path"])
+job_workers = JobWorkerPool(job_queue, job_handlers, concurrency=setup_dict["job_workers"])
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_workers.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_workers.stop()
+    await get_llm_pool(setup_dict).close()
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Label requests by their route template so job ids do not create a series each.
+    path = next((route.path for route in app.routes if route.matches(request.scope)[0] == Match.FULL), "unmatched")
+    start = time.perf_counter()
+    HTTP_IN_FLIGHT.inc(path)
+    try:
+        # Streaming responses are timed until their headers are sent.
+        return await call_next(request)
+    finally:
+        HTTP_IN_FLIGHT.dec(path)
+        HTTP_LATENCY.observe(path, value=time.perf_counter() - start)
+
+
+@app.get('/metrics')
+async def metrics():
+    # Expose the LLM, cache and request metrics in the Prometheus text format.
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 
 @app.post('/find_email_pattern')
 async def process_emails(data: dict):
-    # Go through every domain in json and process its emails.
-    response_data = {}
-    for domain in data:
-        response_data[domain] = await email_processor.process_emails(data[domain])
+    # Process the emails of every domain in json concurrently.
+    response_data = await email_processor.process_domains(data)
 
     return response_data
+
+
+@app.post('/find_email_pattern/stream')
+async def stream_emails(data: dict):
+    # Stream one json line per domain as soon as its pattern is ready.
+    async def generate_lines():
+        start = time.perf_counter()
+        async for domain, pattern, elapsed in email_processor.iter_domains(data):
+            yield json.dumps({
+                "domain": domain,
+                "pattern": pattern,
+                "elapsed_ms": round(elapsed * 1000),
+                "since_start_ms": round((time.perf_counter() - start) * 1000)
+            }) + "\n"
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
+
+@app.post('/jobs')
+async def submit_job(data: dict):
+    # Queue a job of the given type with one item per domain or company.
+    if data.get("type") not in job_handlers:
+        raise HTTPException(status_code=400, detail=f"Job type must be one of {list(job_handlers)}")
+    if not isinstance(data.get("items"), dict):
+        raise HTTPException(status_code=400, detail="Job items must be an object")
+
+    job_id = await asyncio.to_thread(job_queue.submit, data["type"], data["items"])
+    return {"job_id": job_id}
+
+
+@app.get('/jobs/{job_id}')
+async def job_status(job_id: str):
+    status = await asyncio.to_thread(job_queue.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+@app.get('/jobs/{job_id}/results')
+async def job_results(job_id: str, after: int = 0, limit: int = 1000):
+    # Results come in the order the items finished, pass the returned "next" as "after" to get the following page.
+    status = await asyncio.to_thread(job_queue.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    results, next_after = await asyncio.to_thread(job_queue.results, job_id, after, limit)
+    return {"job_id": job_id, "status": status["status"], "next": next_after, "results": results}
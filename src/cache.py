@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.logger import logging
+from src.metrics import CACHE_HIT_RATIO, CACHE_REQUESTS
+
+# Number of hits whose access times are written together, and the milliseconds that write may wait for the database.
+TOUCH_BATCH_SIZE = 100
+TOUCH_BUSY_TIMEOUT_MS = 50
+
+
+def stable_hash(items: list):
+    """
+    Computes a hash of a list of strings that does not depend on their order, case, surrounding whitespace or duplicates.
+
+    Args:
+        items (list): The strings to hash.
+
+    Returns:
+        str: The hex digest of the normalized items.
+    """
+    normalized = sorted({item.strip().lower() for item in items})
+    return hashlib.sha256("\n".join(normalized).encode("utf-8")).hexdigest()
+
+
+class SQLiteCache:
+    """
+    A persistent key value cache backed by a local SQLite file, so results survive restarts and are shared by every
+    worker on the same host. Entries expire after `ttl` seconds and the least recently used entries are evicted once
+    a namespace holds more than `max_entries` entries. Access times only drive the eviction order, so hits record
+    them in memory and write them in batches that are skipped when the database is busy.
+    """
+    def __init__(self, path: str, namespace: str, ttl: float = None, max_entries: int = None):
+        """
+        Initializes the cache and creates its table if needed.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            namespace (str): Name that separates the entries of this cache from the other caches in the same file.
+            ttl (float): Number of seconds after which an entry expires, or None to keep entries forever.
+            max_entries (int): Maximum number of entries kept in the namespace, or None for no limit.
+        """
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._touched = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at)")
+
+    def get(self, key: str):
+        """
+        Looks up a key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            tuple: (True, value) on a hit, (False, None) on a miss or an expired entry.
+        """
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+                ).fetchone()
+                #Expired entries are left for the next write or eviction to replace, so reads never write
+                if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                    self._record(hit=False)
+                    return False, None
+                self._touched[key] = now
+                if len(self._touched) >= TOUCH_BATCH_SIZE:
+                    self._write_access_times()
+                self._record(hit=True)
+                return True, json.loads(row[0])
+        except Exception as excep:
+            logging.error(f"Error reading from {self.namespace} cache: {excep}")
+        self._record(hit=False)
+        return False, None
+
+    def get_many(self, keys: list):
+        """
+        Looks up several keys with one query per 500 keys.
+
+        Args:
+            keys (list): The cache keys.
+
+        Returns:
+            dict: The values of the keys that were hits. Missing and expired keys are left out.
+        """
+        now = time.time()
+        keys = list(dict.fromkeys(keys))
+        values = {}
+        try:
+            with self._lock:
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    rows = self._connection.execute(
+                        f"SELECT key, value, created_at FROM cache WHERE namespace = ? AND key IN ({', '.join('?' * len(batch))})",
+                        (self.namespace, *batch),
+                    ).fetchall()
+                    for key, value, created_at in rows:
+                        if self.ttl is None or now - created_at <= self.ttl:
+                            values[key] = json.loads(value)
+                            self._touched[key] = now
+                if len(self._touched) >= TOUCH_BATCH_SIZE:
+                    self._write_access_times()
+        except Exception as excep:
+            logging.error(f"Error reading from {self.namespace} cache: {excep}")
+            values = {}
+        self._record(hit=True, count=len(values))
+        self._record(hit=False, count=len(keys) - len(values))
+        return values
+
+    def _record(self, hit: bool, count: int = 1):
+        """
+        Counts lookups in the hit and miss counters and in the exported metrics.
+        """
+        if count == 0:
+            return
+        if hit:
+            self.hits += count
+        else:
+            self.misses += count
+        CACHE_REQUESTS.inc(self.namespace, "hit" if hit else "miss", amount=count)
+        CACHE_HIT_RATIO.set(self.namespace, value=self.stats()["hit_ratio"])
+
+    def set(self, key: str, value):
+        """
+        Stores a JSON serializable value under a key.
+
+        Args:
+            key (str): The cache key.
+            value: The value to store.
+        """
+        now = time.time()
+        try:
+            with self._lock:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value), now, now),
+                )
+                self._writes += 1
+                # Counting the namespace is not free, so only check the size limit every 100 writes.
+                if self.max_entries is not None and self._writes % 100 == 1:
+                    self._evict()
+        except Exception as excep:
+            logging.error(f"Error writing to {self.namespace} cache: {excep}")
+
+    def set_many(self, values: dict):
+        """
+        Stores several JSON serializable values in one transaction.
+
+        Args:
+            values (dict): A mapping of cache keys to the values to store.
+        """
+        if len(values) == 0:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._connection.execute("BEGIN")
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    ((self.namespace, key, json.dumps(value), now, now) for key, value in values.items()),
+                )
+                self._connection.execute("COMMIT")
+                # Check the size limit whenever the writes pass 1, 101, 201... as set does.
+                writes = self._writes
+                self._writes += len(values)
+                if self.max_entries is not None and (writes - 1) // 100 != (self._writes - 1) // 100:
+                    self._evict()
+            except Exception as excep:
+                logging.error(f"Error writing to {self.namespace} cache: {excep}")
+                if self._connection.in_transaction:
+                    self._connection.execute("ROLLBACK")
+
+    def _write_access_times(self):
+        """
+        Writes the access times of the recent hits in one transaction. The write waits at most
+        `TOUCH_BUSY_TIMEOUT_MS` for other writers and is dropped if the database stays busy, which only makes the
+        eviction order slightly less accurate.
+        """
+        touched, self._touched = self._touched, {}
+        try:
+            self._connection.execute(f"PRAGMA busy_timeout = {TOUCH_BUSY_TIMEOUT_MS}")
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                ((accessed_at, self.namespace, key) for key, accessed_at in touched.items()),
+            )
+            self._connection.execute("COMMIT")
+        except sqlite3.OperationalError as excep:
+            logging.info(f"Skipped {len(touched)} access times of {self.namespace} cache: {excep}")
+            if self._connection.in_transaction:
+                self._connection.execute("ROLLBACK")
+        finally:
+            self._connection.execute("PRAGMA busy_timeout = 30000")
+
+    def _evict(self):
+        """
+        Deletes expired entries and then the least recently used entries above `max_entries`.
+        """
+        if len(self._touched) > 0:
+            self._write_access_times()
+        if self.ttl is not None:
+            self._connection.execute(
+                "DELETE FROM cache WHERE namespace = ? AND created_at < ?", (self.namespace, time.time() - self.ttl)
+            )
+        size = self._connection.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+        if size > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key IN "
+                "(SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                (self.namespace, self.namespace, size - self.max_entries),
+            )
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of this process.
+
+        Returns:
+            dict: The number of hits, misses and the hit ratio.
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / total if total else 0.0}
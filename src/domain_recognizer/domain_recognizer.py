@@ -18,6 +18,8 @@ from src.domain_recognizer.prompts import recognition_prompt
 from langchain.output_parsers import CommaSeparatedListOutputParser
 
 from src.logger import logging
+from src.llm_client import get_llm_pool
+from src.singleflight import SingleFlight, request_key
 
 import re
 
@@ -55,6 +57,8 @@ class DomainRecognizer:
             user_settings (dict): A dictionary containing user settings, including the OpenAI model name.
         """
         self.debug = user_settings["debug"]
+        self._llm_pool = get_llm_pool(user_settings)
+        self._in_flight = SingleFlight("domain_recognition")
         self.connect_to_llm(user_settings["openAI_model_name"])
         self._initialize_recognition_chain()
 
@@ -68,7 +72,7 @@ class DomainRecognizer:
 
         logging.info("Establishing connection to open ai models for domain recognition")
         try:
-            self._llm = ChatOpenAI(model_name=model_name, temperature=0)
+            self._llm = self._llm_pool.get("domain_recognizer", "recognition", model_name=model_name)
 
             messages = [
                         SystemMessage(
@@ -104,7 +108,28 @@ class DomainRecognizer:
         processed_titles = [domains[i].strip() for i in range(len(domains)) if domains[i].strip() != ""]
         return processed_titles
 
-    async def recognize_company_domain(self, company_name: str, domains: list):
+    async def recognize_company_domain(self, company_name: str, domains: list, raise_errors: bool = False):
+        """
+        Recognizes the domain of a company given its name and a list of domains. Concurrent requests with the same
+        company and domains share one recognition.
+
+        Parameters:
+            company_name: The name of the company.
+            domains (list): The list of domains associated with the company.
+            raise_errors (bool): Raise errors instead of logging them and returning an empty list, for callers that retry.
+
+        Returns:
+            list: The recognized domain(s) of the company.
+        """
+        try:
+            return await self._in_flight.do(request_key(company_name, domains), self._recognize_company_domain, company_name, domains)
+        except Exception as excep:
+            if raise_errors:
+                raise
+            logging.error(f"Error while recognizing domains: {excep}")
+        return []
+
+    async def _recognize_company_domain(self, company_name: str, domains: list):
         """
         Recognizes the domain of a company given its name and a list of domains.
 
@@ -117,25 +142,20 @@ class DomainRecognizer:
         """
         logging.info("Recognizing domains")
         company_name = company_name[0]
-        try:
-            #Remove domains are empty spaces
-            domains = self._preprocess_domains(domains)
-
-            #If no domains are available then just return empty list
-            if len(domains) == 0:
-                return []
-            
-            #Convert domains into str and run the chain
-            str_domains = "\n".join(domains)
-            filtered_result = self._chain({"text":str_domains, "company" : company_name})
-            
-            #Filter and access the final output
-            return filtered_result["final_result"][0]
 
-        except Exception as excep:
-            logging.error(f"Error while translating emails: {excep}")
-        
-        return []
+        #Remove domains are empty spaces
+        domains = self._preprocess_domains(domains)
+
+        #If no domains are available then just return empty list
+        if len(domains) == 0:
+            return []
+
+        #Convert domains into str and run the chain
+        str_domains = "\n".join(domains)
+        filtered_result = await self._chain.acall({"text":str_domains, "company" : company_name})
+
+        #Filter and access the final output
+        return filtered_result["final_result"][0]
 
 
 
@@ -0,0 +1,120 @@
+import asyncio
+import re
+
+from src.logger import logging
+
+
+def build_sections(texts: list):
+    """
+    Joins several inputs into one prompt, each in its own delimited section.
+
+    Args:
+        texts (list): The input of every section.
+
+    Returns:
+        str: The sections, numbered from 1, e.g. "=== DOMAIN 1 ===\n...\n=== END DOMAIN 1 ===".
+    """
+    return "\n\n".join(f"=== DOMAIN {i} ===\n{text}\n=== END DOMAIN {i} ===" for i, text in enumerate(texts, start=1))
+
+
+def split_sections(answer: str, count: int):
+    """
+    Splits an answer to a sectioned prompt back into one answer per section.
+
+    Args:
+        answer (str): The answer of the LLM, with every section under its "=== DOMAIN n ===" header.
+        count (int): The number of sections that were sent.
+
+    Returns:
+        list: The answer of every section in order, or None for the sections missing from the answer.
+    """
+    sections = [None] * count
+    for number, text in re.findall(r"=== DOMAIN (\d+) ===(.*?)(?==== DOMAIN \d+ ===|\Z)", answer, re.DOTALL):
+        index = int(number) - 1
+        text = re.sub(r"=== END DOMAIN \d+ ===", "", text).strip()
+        if 0 <= index < count and sections[index] is None:
+            sections[index] = text
+    return sections
+
+
+class TokenBudgetBatcher:
+    """
+    Collects small work items submitted concurrently and runs them together, so several items share the fixed cost
+    of one prompt. A batch is sent as soon as its items reach the token budget, or `linger` seconds after its first
+    item arrived, whichever comes first.
+    """
+    def __init__(self, run_batch, token_budget: int, linger: float = 0.05):
+        """
+        Initializes the batcher.
+
+        Args:
+            run_batch: A coroutine function that takes a list of items and returns a list with the result of every item.
+            token_budget (int): The number of tokens after which a batch is sent.
+            linger (float): The number of seconds to wait for more items before sending a batch that is not full.
+        """
+        self.token_budget = token_budget
+        self.linger = linger
+        self._run_batch = run_batch
+        self._pending = []
+        self._pending_tokens = 0
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, item, tokens: int):
+        """
+        Adds an item to the next batch and waits for its result.
+
+        Args:
+            item: The work item passed to `run_batch`.
+            tokens (int): The number of tokens the item adds to the batch.
+
+        Returns:
+            The result `run_batch` returned for the item.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if len(self._pending) > 0 and self._pending_tokens + tokens > self.token_budget:
+            self._flush()
+
+        self._pending.append((item, future))
+        self._pending_tokens += tokens
+        if self._pending_tokens >= self.token_budget:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self):
+        """
+        Sends the pending items as one batch.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending, self._pending_tokens = self._pending, [], 0
+        if len(items) > 0:
+            task = asyncio.create_task(self._run(items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, items: list):
+        """
+        Runs a batch and hands every item its result, or the batch's exception if it failed. Every item whose future
+        is still unresolved when the batch ends, because the batch was cancelled or returned too few results, gets
+        an exception, so no caller waits forever.
+        """
+        logging.info(f"Running a batch of {len(items)} items")
+        error = None
+        try:
+            results = await self._run_batch([item for item, _ in items])
+            if len(results) != len(items):
+                raise ValueError(f"Batch returned {len(results)} results for {len(items)} items")
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as excep:
+            error = excep
+        finally:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(error or RuntimeError("Batch stopped before returning its results"))
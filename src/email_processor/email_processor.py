@@ -5,6 +5,7 @@ load_dotenv()
 from langchain.chat_models import ChatOpenAI
 
 import ast
+import json
 
 from langchain.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -15,12 +16,25 @@ from langchain.chains import LLMChain
 from langchain.chains import SimpleSequentialChain
 from langchain.schema import SystemMessage
 
-from src.email_processor.prompts import first_prompt, second_prompt, third_prompt
+from src.email_processor.prompts import first_prompt, second_prompt, third_prompt, batch_first_prompt, batch_second_prompt, structured_prompt
+from src.email_processor.prompts import second_prompt_examples
+from src.email_processor.pattern_inference import PatternInferenceEngine
+from src.email_processor.generic_filter import GenericMailboxFilter
+from src.email_processor.pattern_normalizer import PatternNormalizer
+from src.email_processor.batching import TokenBudgetBatcher, build_sections, split_sections
+from src.email_processor.few_shot import FewShotSelector
 from langchain.output_parsers import CommaSeparatedListOutputParser
 
 from src.logger import logging
+from src.cache import SQLiteCache, stable_hash
+from src.llm_client import get_llm_pool
+from src.singleflight import SingleFlight
+from src.utils import count_tokens
 
 import re
+import time
+import asyncio
+from collections import Counter
 
 class EmailProcesssor:
     """
@@ -29,6 +43,28 @@ class EmailProcesssor:
     def __init__(self, user_settings:dict):
         self.debug = user_settings["debug"]
         self.model_name = user_settings["openAI_model_name"]
+        self.max_concurrent_domains = user_settings.get("max_concurrent_domains", 20)
+        self._inference_engine = PatternInferenceEngine(user_settings)
+        self._generic_filter = GenericMailboxFilter(user_settings)
+        self._normalizer = PatternNormalizer()
+        self._cache = SQLiteCache(user_settings.get("cache_path", "cache/analysis_cache.sqlite3"), "email_patterns",
+                                  ttl=user_settings.get("email_cache_ttl", 30 * 24 * 3600),
+                                  max_entries=user_settings.get("email_cache_max_entries", 100000))
+        self._domain_state = SQLiteCache(user_settings.get("cache_path", "cache/analysis_cache.sqlite3"), "email_domain_state",
+                                         ttl=user_settings.get("domain_state_ttl", 30 * 24 * 3600),
+                                         max_entries=user_settings.get("domain_state_max_entries", 100000))
+        self._domain_locks = {}
+        self.pipeline_mode = user_settings.get("email_pipeline_mode", "two_chain")
+        self._few_shot = FewShotSelector(second_prompt_examples, k=user_settings.get("few_shot_examples", 2))
+        self._all_examples_tokens = count_tokens(self._few_shot.format(second_prompt_examples), self.model_name)
+        self.chunk_token_budget = user_settings.get("chunk_token_budget", 2000)
+        self.chunk_max_emails = user_settings.get("chunk_max_emails", 60)
+        self.batch_small_domains = user_settings.get("batch_small_domains", False)
+        self.batch_max_domain_emails = user_settings.get("batch_max_domain_emails", 10)
+        self._batcher = TokenBudgetBatcher(self._classify_batch, user_settings.get("batch_token_budget", 3000),
+                                           linger=user_settings.get("batch_linger", 0.05))
+        self._llm_pool = get_llm_pool(user_settings)
+        self._in_flight = SingleFlight("email_pattern")
         self._connect_to_llm(user_settings["openAI_model_name"])
         self._initialize_identification_chain()
 
@@ -39,8 +75,8 @@ class EmailProcesssor:
 
         logging.info("Establishing connection to open ai models for email processing")
         try:
-            self._llm_1 = ChatOpenAI(model_name=model_name, temperature=0, max_tokens=4094)
-            self._llm_2 = ChatOpenAI(model_name=model_name, temperature=0, max_tokens=4094)
+            self._llm_1 = self._llm_pool.get("email_processor", "chain_one", model_name=model_name, max_tokens=4094)
+            self._llm_2 = self._llm_pool.get("email_processor", "chain_two", model_name=model_name, max_tokens=4094)
             # self._llm_3 = ChatOpenAI(model_name=model_name, temperature=0, max_tokens=4094)
 
             messages = [
@@ -64,8 +100,14 @@ class EmailProcesssor:
 
         logging.info("Initializing email pattern recognition chains")
         try:
+            batch_llm_1 = self._llm_pool.get("email_processor", "batch_chain_one", max_tokens=4094)
+            batch_llm_2 = self._llm_pool.get("email_processor", "batch_chain_two", max_tokens=4094)
+            structured_llm = self._llm_pool.get("email_processor", "structured", max_tokens=4094)
             self._chain_one = LLMChain(llm=self._llm_1, prompt=first_prompt, output_key="emails")
             self._chain_two = LLMChain(llm=self._llm_2, prompt=second_prompt, output_key="patterns")
+            self._batch_chain_one = LLMChain(llm=batch_llm_1, prompt=batch_first_prompt, output_key="emails")
+            self._batch_chain_two = LLMChain(llm=batch_llm_2, prompt=batch_second_prompt, output_key="patterns")
+            self._structured_chain = LLMChain(llm=structured_llm, prompt=structured_prompt, output_key="result")
             output_parser = CommaSeparatedListOutputParser()        
             # self._chain_three = LLMChain(llm=self._llm_3, prompt=third_prompt, output_key = "final_result", output_parser=output_parser,verbose=False)
             
@@ -85,107 +127,381 @@ class EmailProcesssor:
         Returns:
             str: A post-processed string where certain placeholders and formats have been standardized.
         """
-        #return none if no patterns were found
-        if patterns.strip().lower() == "none":
+        return self._normalizer.code(patterns)
+
+    def _parse_pattern_description(self, pattern_description: str, emails: list):
+        """
+        Extracts the structure of every email from the individual analysis section of the second chain's answer.
+        Emails missing from the individual analysis are assigned the concluded pattern instead.
+
+        Args:
+            pattern_description (str): The answer of the second chain.
+            emails (list): The emails that were sent to the second chain.
+
+        Returns:
+            dict: A mapping of every lower cased email to its post-processed pattern, or None if it has no pattern.
+        """
+        structures = {}
+        for email, structure in re.findall(r"email address:\s*(\S+)\s*\n\s*-?\s*email structure:\s*(.+)", pattern_description, re.IGNORECASE):
+            structures[email.strip().lower()] = self._post_process_text(structure)
+
+        identified_patterns = pattern_description.split(":")[-1]
+        pattern = None if identified_patterns.strip().lower() == "none" else self._post_process_text(identified_patterns)
+        return {email.strip().lower(): structures.get(email.strip().lower(), pattern) for email in emails}
+
+    async def _classify_with_chains(self, emails: list):
+        """
+        Classifies emails with the identification chain. The first chain filters out the emails that have no
+        employee names in them and the second chain describes the structure of the remaining ones.
+
+        Args:
+            emails (list): A list of email strings to be processed.
+
+        Returns:
+            dict: A mapping of every lower cased email to its post-processed pattern, or None if it has no pattern.
+        """
+        codes = {email.strip().lower(): None for email in emails}
+
+        #Recieve output as comma seperated string.
+        filtered_emails = await self._chain_one.arun("\n".join(emails))
+        if filtered_emails.strip().lower() == "none":
+            return codes
+
+        personal_emails = [email for email in re.split(r"[\s,]+", filtered_emails) if "@" in email]
+        examples = self._few_shot.format(self._few_shot.select(personal_emails))
+        logging.info(f"Second chain uses {count_tokens(examples, self.model_name)} example tokens instead of {self._all_examples_tokens}")
+        pattern_description = await self._chain_two.arun({"emails": filtered_emails, "examples": examples})
+        codes.update(self._parse_pattern_description(pattern_description, personal_emails))
+        return codes
+
+    async def _classify_batch(self, email_lists: list):
+        """
+        Classifies the emails of several small domains with the batched identification chain, which packs every
+        domain into its own delimited section of a single prompt and splits the answer back per domain.
+
+        Args:
+            email_lists (list): The list of emails of every domain.
+
+        Returns:
+            list: For every domain, a mapping of every lower cased email to its post-processed pattern, or None if
+                the domain is missing from one of the answers.
+        """
+        results = [{email.strip().lower(): None for email in emails} for emails in email_lists]
+
+        answer = await self._batch_chain_one.arun(build_sections(["\n".join(emails) for emails in email_lists]))
+        pending = []
+        for i, section in enumerate(split_sections(answer, len(email_lists))):
+            if section is None:
+                results[i] = None
+                continue
+            personal_emails = [email for email in re.split(r"[\s,]+", section) if "@" in email]
+            if len(personal_emails) > 0:
+                pending.append((i, personal_emails))
+
+        if len(pending) > 0:
+            answer = await self._batch_chain_two.arun(build_sections(["\n".join(emails) for _, emails in pending]))
+            for (i, personal_emails), section in zip(pending, split_sections(answer, len(pending))):
+                if section is None:
+                    results[i] = None
+                    continue
+                results[i].update(self._parse_pattern_description(section, personal_emails))
+
+        return results
+
+    def _parse_structured_answer(self, answer: str, emails: list):
+        """
+        Parses the JSON answer of the structured chain.
+
+        Args:
+            answer (str): The answer of the structured chain.
+            emails (list): The emails that were sent to the structured chain.
+
+        Returns:
+            dict: A mapping of every lower cased email to its post-processed pattern, or None if it has no pattern.
+                Personal emails without a structure of their own are assigned the majority pattern.
+        """
+        result = json.loads(answer[answer.index("{"):answer.rindex("}") + 1])
+        structures = {item["email"].strip().lower(): self._post_process_text(item["structure"]) for item in result.get("structures", [])}
+        majority_pattern = self._post_process_text(result.get("majority_pattern") or "none")
+
+        codes = {email.strip().lower(): None for email in emails}
+        for email in result.get("personal_emails", []):
+            codes[email.strip().lower()] = structures.get(email.strip().lower(), majority_pattern)
+        return codes
+
+    async def _classify_with_structured_call(self, emails: list):
+        """
+        Classifies emails with a single call that filters the personal emails and describes their structures as JSON,
+        instead of the two chained calls. Falls back to the two chains if the answer is not valid JSON.
+
+        Args:
+            emails (list): A list of email strings to be processed.
+
+        Returns:
+            dict: A mapping of every lower cased email to its post-processed pattern, or None if it has no pattern.
+        """
+        answer = await self._structured_chain.arun("\n".join(emails))
+        try:
+            return self._parse_structured_answer(answer, emails)
+        except (ValueError, KeyError, TypeError, AttributeError) as excep:
+            logging.warning(f"Could not parse structured answer, falling back to the two chains: {excep}")
+        return await self._classify_with_chains(emails)
+
+    def _chunk_emails(self, emails: list):
+        """
+        Splits emails into chunks that fit the prompt token budget and whose analysis fits the completion tokens.
+
+        Args:
+            emails (list): A list of email strings.
+
+        Returns:
+            list: The chunks, each a list of at most `chunk_max_emails` emails.
+        """
+        chunks = [[]]
+        tokens = 0
+        for email in emails:
+            email_tokens = count_tokens(email, self.model_name) + 1
+            if len(chunks[-1]) > 0 and (tokens + email_tokens > self.chunk_token_budget or len(chunks[-1]) >= self.chunk_max_emails):
+                chunks.append([])
+                tokens = 0
+            chunks[-1].append(email)
+            tokens += email_tokens
+        return chunks
+
+    async def _classify_with_llm(self, emails: list):
+        """
+        Classifies emails with the LLM. Lists too large for one prompt are split into token-budgeted chunks that are
+        classified concurrently, and the per email patterns of every chunk are merged. A failed chunk is retried once.
+
+        Args:
+            emails (list): A list of email strings to be processed.
+
+        Returns:
+            dict: A mapping of every lower cased email to its post-processed pattern, or None if it has no pattern.
+        """
+        chunks = self._chunk_emails(emails)
+        if len(chunks) == 1:
+            return await self._classify_chunk(emails)
+
+        async def classify_chunk(chunk):
+            try:
+                return await self._classify_chunk(chunk)
+            except Exception as excep:
+                logging.warning(f"Retrying chunk of {len(chunk)} emails after error: {excep}")
+                return await self._classify_chunk(chunk)
+
+        logging.info(f"Splitting {len(emails)} emails into {len(chunks)} chunks")
+        codes = {}
+        for chunk_codes in await asyncio.gather(*(classify_chunk(chunk) for chunk in chunks)):
+            codes.update(chunk_codes)
+        return codes
+
+    async def _classify_chunk(self, emails: list):
+        """
+        Classifies emails with the LLM, either with one structured call or with the two chains depending on
+        `email_pipeline_mode`. In the two chain mode, small domains are packed together with other small domains
+        in flight into one token-budgeted request when batching is enabled, and fall back to their own request if
+        the batched answer is missing them.
+
+        Args:
+            emails (list): A list of email strings to be processed.
+
+        Returns:
+            dict: A mapping of every lower cased email to its post-processed pattern, or None if it has no pattern.
+        """
+        if self.pipeline_mode == "structured":
+            return await self._classify_with_structured_call(emails)
+
+        if self.batch_small_domains and len(emails) <= self.batch_max_domain_emails:
+            #Budget for the emails going in and about 40 tokens of individual analysis per email coming out
+            tokens = count_tokens("\n".join(emails), self.model_name) + 40 * len(emails)
+            try:
+                codes = await self._batcher.submit(emails, tokens)
+                if codes is not None:
+                    return codes
+                logging.warning("Domain missing from the batched answer, processing it on its own")
+            except Exception as excep:
+                logging.error(f"Error while processing batch of emails: {excep}")
+
+        return await self._classify_with_chains(emails)
+
+    async def _classify_emails(self, emails: list, prior_votes: Counter):
+        """
+        Classifies emails into patterns with the local filters, and with the identification chain only when the
+        local rule engine is not confident enough.
+
+        Args:
+            emails (list): A list of email strings to be processed.
+            prior_votes (Counter): The pattern votes of the emails of the domain that were already classified.
+
+        Returns:
+            dict: A mapping of every classified lower cased email to its pattern, or None if it has no pattern.
+                Emails left out of the sample or that the local rule engine could not classify are missing, so a
+                later call classifies them.
+        """
+        #Remove generic role addresses locally so they never reach the prompt
+        personal_emails = self._generic_filter.filter(emails)
+        kept = {email.strip().lower() for email in personal_emails}
+        codes = {email.strip().lower(): None for email in emails
+                 if email.strip().lower() not in kept and self._generic_filter.is_generic(email)}
+        emails = personal_emails
+        if len(emails) == 0:
+            return codes
+
+        #Skip the llm when the local rule engine is confident about the pattern
+        pattern, confidence = self._inference_engine.infer(emails, prior_votes)
+        if confidence >= self._inference_engine.confidence_threshold:
+            logging.info(f"Pattern {pattern} inferred locally with confidence {confidence:.2f}")
+            for email in emails:
+                code = self._inference_engine.classify_email(email)[0]
+                if code is not None:
+                    codes[email.strip().lower()] = code
+            return codes
+
+        codes.update(await self._classify_with_llm(emails))
+        return codes
+
+    async def _find_pattern(self, emails: list, domain: str = None):
+        """
+        Identifies the pattern of a list of emails. The classified emails and pattern votes of every domain are kept,
+        so when a known domain comes back only its new emails are classified and their votes merged in. Calls for
+        the same domain run one at a time, so one call never overwrites the votes merged by another.
+
+        Args:
+            emails (list): A list of email strings to be processed.
+            domain (str): The domain the emails belong to, or None to classify every email without keeping state.
+
+        Returns:
+            str or None: The most voted pattern in a post-processed format, or None if no patterns are identified.
+        """
+        if len(emails) == 0:
             return None
+        if domain is None:
+            return await self._update_domain_pattern(emails, None)
+
+        #The lock is shared by the calls waiting for the domain and dropped with the last of them
+        entry = self._domain_locks.setdefault(domain, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._update_domain_pattern(emails, domain)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._domain_locks[domain]
+
+    async def _update_domain_pattern(self, emails: list, domain: str):
+        """
+        Classifies the emails the domain state does not have yet, merges their votes in and saves the state.
+
+        Args:
+            emails (list): A list of email strings to be processed.
+            domain (str): The domain the emails belong to, or None to classify every email without keeping state.
 
-        patterns = patterns.strip().lower().split("@")[0].strip()
-        
-        patterns = patterns.replace("company domain", "")
-        patterns = patterns.replace("companydomain", "")
-        patterns = patterns.replace("dot", ".")
-        patterns = patterns.replace("underscore", "_")
-        patterns = patterns.replace("dash", "-")
-        patterns = patterns.replace("hyphen", "-")
-        patterns = patterns.replace("{", "[")
-        patterns = patterns.replace("}", "]")
-        
-        patterns = patterns.replace("[first name initials (2 initials)]", "f1m1")
-        patterns = patterns.replace("[first name initial (1 initial)]", "f1")
-        
-        patterns = patterns.replace("[first name]", "f")
-        patterns = patterns.replace("[middle name]", "m")
-        patterns = patterns.replace("[last name]", "l")
-
-        patterns = patterns.replace("[firstname]", "f")
-        patterns = patterns.replace("[middlename]", "m")
-        patterns = patterns.replace("[lastname]", "l")
-
-        patterns = patterns.replace("[first initial]", "f1")
-        patterns = patterns.replace("[last initial]", "l1")
-
-        patterns = patterns.replace("first name", "f")
-        patterns = patterns.replace("last name", "l")
-        patterns = patterns.replace("firstname", "f")
-        patterns = patterns.replace("lastname", "l")
-        patterns = patterns.replace("full first name", "f")
-        patterns = patterns.replace("full last name", "l")
-        patterns = patterns.replace("full firstname", "f")
-        patterns = patterns.replace("full lastname", "l")
-        patterns = patterns.replace("first name initial", "f1")
-        patterns = patterns.replace("last name initial", "l1")
-        patterns = patterns.replace("firstname initial", "f1")
-        patterns = patterns.replace("lastname initial", "l1")
-        patterns = patterns.replace("first initial", "f1")
-        patterns = patterns.replace("last initial", "l1")
-        patterns = patterns.replace("first letter of last name", "l1")
-        patterns = patterns.replace("first letter of first name", "f1")
-        patterns = patterns.replace("first letter of lastname", "l1")
-        patterns = patterns.replace("first letter of firstname", "f1")
-        patterns = patterns.replace("first initial of last name", "l1")
-        patterns = patterns.replace("first initial of first name", "f1")
-        patterns = patterns.replace("first initial of lastname", "l1")
-        patterns = patterns.replace("first initial of firstname", "f1")
-        patterns = patterns.replace("first", "f")
-        patterns = patterns.replace("last", "l")
-        patterns = patterns.replace("+", "")
-        patterns = patterns.replace(" ", "")
-        patterns = patterns.replace(",", ".")
-        patterns = patterns.replace("[", ".")
-        patterns = patterns.replace("]", "")
-
-        if len(patterns) > 9:
+        Returns:
+            str or None: The most voted pattern in a post-processed format, or None if no patterns are identified.
+        """
+        state = {"emails": {}, "votes": {}}
+        if domain is not None:
+            hit, stored_state = await asyncio.to_thread(self._domain_state.get, domain)
+            if hit:
+                state = stored_state
+
+        new_emails = list({email.strip().lower(): email for email in emails if email.strip().lower() not in state["emails"]}.values())
+        if len(new_emails) > 0:
+            logging.info(f"Classifying {len(new_emails)} new emails of {len(emails)}")
+            state["emails"].update(await self._classify_emails(new_emails, Counter(state["votes"])))
+            state["votes"] = Counter(code for code in state["emails"].values() if code is not None)
+            if domain is not None:
+                await asyncio.to_thread(self._domain_state.set, domain, state)
+
+        if len(state["votes"]) == 0:
             return None
-        
-        return patterns
+        return Counter(state["votes"]).most_common(1)[0][0]
 
-    async def process_emails(self, emails: list):
+    async def process_emails(self, emails: list, domain: str = None, raise_errors: bool = False):
         """
-        Processes a list of emails to identify patterns using the defined identification chain.
+        Processes a list of emails to identify patterns, answering from the persistent cache when the same domain
+        was already analysed with the same set of emails. Concurrent requests for the same domain and set of emails
+        share one analysis.
 
         Args:
             emails (list): A list of email strings to be processed.
+            domain (str): The domain the emails belong to, used as part of the cache key.
+            raise_errors (bool): Raise errors instead of logging them and returning None, for callers that retry.
 
         Returns:
             str or None: The identified patterns in a post-processed format, or None if no patterns are identified.
         """
         logging.info("Finding patterns in emails")
-        try:
-            if len(emails) == 0:
-                return None
-
-            emails = "\n".join(emails)
-            
-            #Recieve output as comma seperated string.
-            filtered_emails =  self._chain_one.run(emails)
-            if filtered_emails.strip().lower() == "none":
-                return None
-            
-            pattern_description =  self._chain_two.run(filtered_emails)
-            identified_patterns = pattern_description.split(":")[-1]
-            if identified_patterns.strip().lower() == "none":
-                return None
+        cache_key = f"{domain}:{stable_hash(emails)}"
+        hit, pattern = await asyncio.to_thread(self._cache.get, cache_key)
+        if hit:
+            logging.info(f"Pattern for {domain} found in cache")
+            return pattern
 
-            # patterns =  self._chain_three.run({"structure": pattern_description})
-            pattern = identified_patterns
-            
-            return self._post_process_text(pattern)
+        try:
+            return await self._in_flight.do(cache_key, self._find_and_cache_pattern, emails, domain, cache_key)
         except Exception as excep:
+            if raise_errors:
+                raise
             logging.error(f"Error while processing emails: {excep}")
+        return None
 
+    async def _find_and_cache_pattern(self, emails: list, domain: str, cache_key: str):
+        """
+        Identifies the pattern of a list of emails and caches it. Errors are raised, so failed analyses are never cached.
 
+        Args:
+            emails (list): A list of email strings to be processed.
+            domain (str): The domain the emails belong to.
+            cache_key (str): The key the pattern is cached under.
 
+        Returns:
+            str or None: The identified patterns in a post-processed format, or None if no patterns are identified.
+        """
+        pattern = await self._find_pattern(emails, domain)
+        await asyncio.to_thread(self._cache.set, cache_key, pattern)
+        return pattern
 
-       
+    async def iter_domains(self, data: dict):
+        """
+        Processes the emails of every domain concurrently, with at most `max_concurrent_domains` domains in flight at
+        a time, and yields every result as soon as it is ready.
 
+        Args:
+            data (dict): A mapping of domain names to their list of email strings.
 
+        Yields:
+            tuple: The domain, its identified pattern (or None) and the seconds it took, in completion order.
+        """
+        logging.info(f"Processing {len(data)} domains")
+        semaphore = asyncio.Semaphore(self.max_concurrent_domains)
+
+        async def process_domain(domain):
+            async with semaphore:
+                start = time.perf_counter()
+                pattern = await self.process_emails(data[domain], domain)
+                return domain, pattern, time.perf_counter() - start
+
+        tasks = [asyncio.create_task(process_domain(domain)) for domain in data]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            #Stop the remaining domains if the consumer goes away early
+            for task in tasks:
+                task.cancel()
+
+    async def process_domains(self, data: dict):
+        """
+        Processes the emails of every domain concurrently, with at most `max_concurrent_domains` domains in flight at a time.
+
+        Args:
+            data (dict): A mapping of domain names to their list of email strings.
+
+        Returns:
+            dict: A mapping of every input domain to its identified pattern (or None), in the same order as the input.
+        """
+        patterns = {domain: pattern async for domain, pattern, _ in self.iter_domains(data)}
+        return {domain: patterns[domain] for domain in data}
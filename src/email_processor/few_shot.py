@@ -0,0 +1,76 @@
+import re
+
+
+class FewShotSelector:
+    """
+    Picks the few-shot examples of the second chain that are closest to the input emails, so the prompt carries one
+    or two relevant worked examples instead of the whole library. Emails are compared by their separator and initial
+    style: the share of local parts using ".", "_", "-" or no separator, starting or ending with one or two initials,
+    and the share of long undelimited local parts.
+    """
+    def __init__(self, examples: list, k: int = 2):
+        """
+        Initializes the selector.
+
+        Args:
+            examples (list): The example strings, each starting with the example emails between "###" delimiters.
+            k (int): The number of examples to select.
+        """
+        self.examples = examples
+        self.k = k
+        self._example_features = []
+        for example in examples:
+            emails = re.search(r"###(.*?)###", example, re.DOTALL).group(1).split()
+            self._example_features.append(self._features(emails))
+
+    def _features(self, emails: list):
+        """
+        Computes the style features of a list of emails.
+
+        Args:
+            emails (list): A list of email strings.
+
+        Returns:
+            list: The share of local parts with every style.
+        """
+        counts = [0] * 7
+        for email in emails:
+            local_part = email.strip().lower().split("@")[0].strip("+0123456789")
+            tokens = [token for token in re.split(r"[._-]", local_part) if token != ""]
+            counts[0] += "." in local_part
+            counts[1] += "_" in local_part
+            counts[2] += "-" in local_part
+            counts[3] += len(tokens) == 1
+            counts[4] += len(tokens) > 1 and (len(tokens[0]) == 1 or len(tokens[-1]) == 1)
+            counts[5] += len(tokens) > 1 and (len(tokens[0]) == 2 or len(tokens[-1]) == 2)
+            counts[6] += len(tokens) == 1 and len(local_part) >= 10
+        return [count / max(1, len(emails)) for count in counts]
+
+    def select(self, emails: list):
+        """
+        Selects the examples closest to the input emails, preferring the shorter example on ties.
+
+        Args:
+            emails (list): A list of email strings.
+
+        Returns:
+            list: The `k` closest example strings.
+        """
+        features = self._features(emails)
+        distances = [
+            (sum(abs(a - b) for a, b in zip(features, example_features)), len(example), i)
+            for i, (example, example_features) in enumerate(zip(self.examples, self._example_features))
+        ]
+        return [self.examples[i] for _, _, i in sorted(distances)[:self.k]]
+
+    def format(self, examples: list):
+        """
+        Formats examples for the `{examples}` variable of the prompt.
+
+        Args:
+            examples (list): The example strings.
+
+        Returns:
+            str: The numbered examples, each delimited by triple backticks.
+        """
+        return "\n\n".join(f"Example {i}:```\n{example}\n```" for i, example in enumerate(examples, start=1))
@@ -0,0 +1,236 @@
+import re
+
+from src.logger import logging
+
+# Departments, functions, job titles and system mailboxes in the languages we see most in scraped data.
+ROLE_WORDS = {
+    # general contact
+    "info", "infos", "information", "informationen", "informazioni", "informacion", "contact", "contacts", "kontakt",
+    "contatto", "contatti", "contacto", "contato", "mail", "email", "office", "offices", "buero", "bureau", "ufficio",
+    "oficina", "escritorio", "hello", "hallo", "hola", "ciao", "bonjour", "welcome", "general", "central", "centrale",
+    "zentrale", "headoffice", "reception", "empfang", "accueil", "team", "staff", "enquiries", "enquiry", "inquiries",
+    "inquiry", "request", "requests", "anfrage", "anfragen", "richieste", "consulta", "consultas", "demande", "feedback",
+    # sales, purchasing and orders
+    "sales", "sale", "ventas", "vendite", "verkauf", "vertrieb", "ventes", "vendas", "commercial", "commerciale",
+    "comercial", "export", "import", "einkauf", "achats", "achat", "compras", "acquisti", "purchasing", "purchase",
+    "procurement", "order", "orders", "bestellung", "bestellungen", "commande", "commandes", "pedidos", "ordini",
+    "shop", "webshop", "store", "booking", "bookings", "reservations", "quotes", "offerte", "angebot",
+    # finance and administration
+    "invoice", "invoices", "rechnung", "rechnungen", "factures", "facturation", "facturas", "fatture", "billing",
+    "accounts", "accounting", "finance", "financial", "finanzas", "finanza", "buchhaltung", "comptabilite",
+    "contabilidad", "contabilita", "payments", "admin", "administrator", "administration", "amministrazione",
+    "administracion", "verwaltung", "secretary", "sekretariat", "segreteria", "secretaria", "secretariat",
+    "legal", "privacy", "datenschutz", "compliance", "security",
+    # people and careers
+    "jobs", "job", "career", "careers", "karriere", "bewerbung", "bewerbungen", "empleo", "lavoro", "lavora",
+    "trabajo", "emploi", "recrutement", "recruiting", "recruitment", "talent", "rrhh", "personal", "personale",
+    "personnel", "humanresources",
+    # departments and job titles
+    "marketing", "press", "presse", "stampa", "prensa", "media", "news", "newsletter", "communications",
+    "kommunikation", "comunicazione", "events", "event", "support", "service", "services", "servicio", "servizio",
+    "customer", "customers", "customerservice", "kundenservice", "kundendienst", "assistance", "assistenza",
+    "asistencia", "helpdesk", "help", "technik", "technical", "engineering", "logistics", "logistik", "logistica",
+    "shipping", "versand", "quality", "qualitaet", "qualita", "calidad", "qualite", "production", "produktion",
+    "produzione", "produccion", "director", "direction", "direzione", "direccion", "management", "manager",
+    "geschaeftsfuehrung", "board", "president", "investor", "investors", "ceo", "cfo", "cto", "coo",
+    # system mailboxes
+    "noreply", "donotreply", "webmaster", "postmaster", "hostmaster", "mailer", "daemon", "mailerdaemon",
+    "notifications", "notification", "alerts", "bounce", "abuse", "spam", "root", "system", "sysadmin", "test", "demo",
+}
+
+# Countries and regions. Several are also first names (India, Asia, America), so they only count when they make up the
+# whole local part (mexico@) or follow a role word (infoitaly@).
+COUNTRY_WORDS = {
+    "mexico", "usa", "america", "americas", "italy", "italia", "germany", "deutschland", "france", "spain", "espana",
+    "china", "india", "japan", "brasil", "brazil", "canada", "russia", "poland", "polska", "austria", "oesterreich",
+    "schweiz", "suisse", "swiss", "nederland", "netherlands", "belgium", "belgique", "sweden", "sverige", "norway",
+    "norge", "denmark", "danmark", "finland", "suomi", "turkey", "turkiye", "portugal", "europe", "emea", "asia",
+    "apac", "latam", "africa", "mideast",
+}
+
+# Country codes that may follow a role word (infoit, salesde, vertriebat).
+COUNTRY_CODES = {
+    "at", "au", "be", "br", "ca", "ch", "cn", "cz", "de", "dk", "es", "eu", "fi", "fr", "gr", "hu", "ie", "in", "it",
+    "jp", "mx", "nl", "no", "pl", "pt", "ro", "ru", "se", "sk", "tr", "uk", "us",
+}
+
+# Short role words only count when they make up the whole local part (hr@, pr@, it@) since they collide with initials.
+SHORT_ROLE_WORDS = {"hr", "pr", "ir", "it", "rh", "gf", "ap", "ar", "qa", "uk", "us"}
+
+
+class GenericMailboxFilter:
+    """
+    A fast local classifier that removes role addresses (sales@, info-it@, noreply@, mexico@) from a list of emails
+    before it is sent to the LLM. Local parts are matched token by token against a multilingual set of role words,
+    and compounds such as `infoitaly` or `salesteam` are matched with a prefix trie.
+    """
+    def __init__(self, user_settings: dict):
+        """
+        Initializes the filter.
+
+        Args:
+            user_settings (dict): A dictionary containing user settings. The optional key `max_prompt_emails` caps the number of emails kept.
+        """
+        self.max_prompt_emails = user_settings.get("max_prompt_emails", 1000)
+        self._trie = self._build_trie(word for word in ROLE_WORDS if len(word) >= 4)
+
+    def _build_trie(self, words):
+        """
+        Builds a character trie of the given words. The end of a word is marked by the key None.
+
+        Args:
+            words (iterable): The words to insert.
+
+        Returns:
+            dict: The root node of the trie.
+        """
+        root = {}
+        for word in words:
+            node = root
+            for char in word:
+                node = node.setdefault(char, {})
+            node[None] = True
+        return root
+
+    def _role_prefixes(self, text: str):
+        """
+        Finds every role word that the text starts with.
+
+        Args:
+            text (str): The compact local part.
+
+        Returns:
+            list: The lengths of the matching role words.
+        """
+        lengths = []
+        node = self._trie
+        for i, char in enumerate(text):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                lengths.append(i + 1)
+        return lengths
+
+    def _is_role_compound(self, text: str):
+        """
+        Checks if the text is a role word followed by a country code, a country or another role word (infoit,
+        infoitaly, salesteam). Any other rest, even a single letter, is part of a name (testa, officer).
+
+        Args:
+            text (str): The compact local part.
+
+        Returns:
+            bool: True if the text is made of role words.
+        """
+        for length in self._role_prefixes(text):
+            rest = text[length:]
+            if (len(rest) == 0 or rest in COUNTRY_CODES or rest in COUNTRY_WORDS or rest in ROLE_WORDS
+                    or rest in SHORT_ROLE_WORDS or self._is_role_compound(rest)):
+                return True
+        return False
+
+    def is_generic(self, email: str):
+        """
+        Checks if an email is a generic role address rather than a personal one.
+
+        Args:
+            email (str): The email address.
+
+        Returns:
+            bool: True if the email is a role address.
+        """
+        local_part, _, domain = email.strip().lower().lstrip("+").partition("@")
+        tokens = [token for token in re.split(r"[._\-+0-9]+", local_part) if token != ""]
+        compact = "".join(tokens)
+        if len(compact) == 0:
+            return True
+        if compact in ROLE_WORDS or compact in SHORT_ROLE_WORDS or compact in COUNTRY_WORDS:
+            return True
+        # The company name itself, e.g. ascometal@ascometal.com
+        if compact == domain.split(".")[0].replace("-", ""):
+            return True
+        # A delimited local part is generic only if every token is a role word (sales.team, info-it). Mixed ones
+        # (helena.press, tom.root) are left to the LLM.
+        if len(tokens) > 1:
+            return all(self._is_role_token(token) for token in tokens)
+        return self._is_role_compound(compact)
+
+    def _is_role_token(self, token: str):
+        """
+        Checks if one token of a delimited local part is a role word, a country or country code, or a role compound.
+
+        Args:
+            token (str): The token.
+
+        Returns:
+            bool: True if the token is made of role words.
+        """
+        return (token in ROLE_WORDS or token in SHORT_ROLE_WORDS or token in COUNTRY_WORDS or token in COUNTRY_CODES
+                or self._is_role_compound(token))
+
+    def _style(self, email: str):
+        """
+        Describes the style of a local part by its separators and the lengths of its first and last tokens.
+
+        Args:
+            email (str): The email address.
+
+        Returns:
+            tuple: The style of the local part, e.g. (".", 1, 3) for j.smith@company.com.
+        """
+        local_part = email.lower().split("@")[0]
+        tokens = [token for token in re.split(r"[._-]", local_part) if token != ""] or [""]
+        separators = "".join(sorted(set(re.sub(r"[^._-]", "", local_part))))
+        return separators, min(len(tokens[0]), 3), min(len(tokens[-1]), 3)
+
+    def stratified_sample(self, emails: list, size: int):
+        """
+        Samples emails so that every local part style keeps its share of the list, and every style is represented.
+
+        Args:
+            emails (list): A list of email strings.
+            size (int): The number of emails to keep.
+
+        Returns:
+            list: At most `size` emails, in their original order.
+        """
+        if len(emails) <= size:
+            return emails
+
+        strata = {}
+        for i, email in enumerate(emails):
+            strata.setdefault(self._style(email), []).append(i)
+
+        #Every style gets its proportional share, and at least one email while there is room
+        kept = []
+        for indexes in sorted(strata.values(), key=len):
+            share = min(len(indexes), max(1, round(size * len(indexes) / len(emails))), size - len(kept))
+            if share <= 0:
+                continue
+            step = len(indexes) / share
+            kept.extend(indexes[int(j * step)] for j in range(share))
+        return [emails[i] for i in sorted(kept)]
+
+    def filter(self, emails: list):
+        """
+        Removes duplicates and generic role addresses from a list of emails and caps its length with a stratified sample.
+
+        Args:
+            emails (list): A list of email strings.
+
+        Returns:
+            list: The personal looking emails, at most `max_prompt_emails` of them.
+        """
+        seen = set()
+        personal_emails = []
+        for email in emails:
+            key = email.strip().lower()
+            if key in seen or "@" not in key:
+                continue
+            seen.add(key)
+            if not self.is_generic(key):
+                personal_emails.append(email.strip())
+
+        logging.info(f"Kept {len(personal_emails)} of {len(emails)} emails after removing generic addresses")
+        return self.stratified_sample(personal_emails, self.max_prompt_emails)
@@ -0,0 +1,189 @@
+from collections import Counter
+import os
+import re
+
+from src.logger import logging
+
+# Common first names of the languages we see most in scraped data, one per line. Names shorter than three letters are
+# left out since they also start many last names.
+FIRST_NAMES_PATH = os.path.join(os.path.dirname(__file__), "data", "first_names.txt")
+
+# Two letter onsets that commonly start a first name. An undelimited local part that starts with two
+# consonants outside this set (dnikolic, vgergulov, jpfisterer) is most likely an initial followed by a last name.
+NAME_ONSETS = {
+    "bl", "br", "ch", "cl", "cr", "dr", "dj", "fl", "fr", "gl", "gr", "kl", "kr", "ph", "pl", "pr",
+    "sc", "sh", "sk", "sl", "sm", "sn", "sp", "st", "sv", "sw", "th", "tr", "tw", "wr", "zh",
+}
+# Endings that turn a first name into a last name (robertson, danielsson, markovic, janowski), so a first name
+# followed by one of them is not an undelimited first and last name.
+SURNAME_ENDINGS = {"son", "sen", "sson", "ssen", "sohn", "vic", "ovic", "evic", "ich", "off", "ova", "eva", "enko", "ski", "ska", "sky",
+                  "owski", "ewski", "owska", "ewska"}
+VOWELS = set("aeiouyàáâäãåèéêëìíîïòóôöõùúûüýæøœ")
+# Weight of a vote whose name order the first name dictionary cannot settle (smith.john or john.smith). It keeps a
+# domain of such votes below the confidence threshold, so the LLM decides the order.
+ORDER_AMBIGUOUS_WEIGHT = 0.5
+
+
+class PatternInferenceEngine:
+    """
+    A deterministic engine that infers the email pattern of a domain from the local parts of its emails.
+    Every email is tokenized and classified into one of the canonical pattern codes emitted by
+    `EmailProcesssor._post_process_text` (f.l, f1l, fl, l_f1m1, ...), and the codes are weighted and voted on.
+    The reported confidence lets the caller decide whether the LLM chains are still needed.
+    """
+    def __init__(self, user_settings: dict):
+        """
+        Initializes the engine.
+
+        Args:
+            user_settings (dict): A dictionary containing user settings. The optional keys are
+                `pattern_confidence_threshold`, `pattern_min_votes` and `first_names_path`, a text file with one first
+                name per line that defaults to the bundled data/first_names.txt, or None to use no dictionary.
+        """
+        self.confidence_threshold = user_settings.get("pattern_confidence_threshold", 0.8)
+        self.min_votes = user_settings.get("pattern_min_votes", 3)
+        self._first_names = self._load_first_names(user_settings.get("first_names_path", FIRST_NAMES_PATH))
+
+    def _load_first_names(self, path: str):
+        """
+        Loads the optional first name dictionary.
+
+        Args:
+            path (str): Path of a text file with one first name per line, or None.
+
+        Returns:
+            set: The lower cased first names.
+        """
+        if path is None:
+            return set()
+        try:
+            with open(path, encoding="utf-8") as f:
+                return {line.strip().lower() for line in f if line.strip()}
+        except Exception as excep:
+            logging.error(f"Error loading first names dictionary: {excep}")
+        return set()
+
+    def _tokenize(self, email: str):
+        """
+        Splits the local part of an email into name tokens and separators.
+
+        Args:
+            email (str): The email address.
+
+        Returns:
+            list: The tokens and separators in order, e.g. ["john", ".", "smith"]. Empty if the local part cannot be tokenized.
+        """
+        local_part = email.strip().lower().split("@")[0].lstrip("+")
+        # Trailing numbers (kamynina_ei2) are used to disambiguate employees and are not part of the pattern.
+        local_part = local_part.rstrip("0123456789")
+        if len(local_part) == 0 or not all(char.isalpha() or char in "._-" for char in local_part):
+            return []
+        return [token for token in re.split(r"([._-])", local_part) if token != ""]
+
+    def _classify_single_token(self, token: str):
+        """
+        Classifies an undelimited local part such as `oskar`, `dnikolic` or `vladimirnovakovic`.
+
+        Args:
+            token (str): The local part.
+
+        Returns:
+            tuple: The pattern code and the weight of the vote, or (None, 0) if the token is ambiguous.
+        """
+        if token in self._first_names:
+            return "f", 1.0
+        for end in range(len(token) - 1, 2, -1):
+            if token[:end] in self._first_names:
+                #The longest first name decides, williams is william and an s rather than willi and ams
+                rest = token[end:]
+                if len(rest) < 3 or rest in SURNAME_ENDINGS:
+                    return None, 0
+                return "fl", 1.0
+        if len(token) >= 5 and token[:2] not in NAME_ONSETS and token[0] not in VOWELS and token[1] not in VOWELS:
+            return "f1l", 0.6
+        return None, 0
+
+    def _classify_two_tokens(self, first: str, separator: str, second: str):
+        """
+        Classifies a local part made of two tokens joined by a separator.
+
+        Args:
+            first (str): The token before the separator.
+            separator (str): One of ".", "_" or "-".
+            second (str): The token after the separator.
+
+        Returns:
+            tuple: The pattern code and the weight of the vote, or (None, 0) if the tokens are ambiguous.
+        """
+        if len(first) >= 3 and len(second) >= 3:
+            if second in self._first_names and first not in self._first_names:
+                return f"l{separator}f", 1.0
+            if first in self._first_names and second not in self._first_names:
+                return f"f{separator}l", 1.0
+            return f"f{separator}l", ORDER_AMBIGUOUS_WEIGHT
+        if len(first) == 1 and len(second) >= 3:
+            return f"f1{separator}l", 1.0
+        if len(first) == 2 and len(second) >= 3:
+            return f"f1m1{separator}l", 0.8
+        if len(first) >= 3 and len(second) <= 2:
+            #Trailing initials follow a last name (smith.j, ivanov.ai) unless the name before them is a known first name (john.s)
+            if first in self._first_names:
+                return (f"f{separator}l1", 1.0) if len(second) == 1 else (None, 0)
+            initials = "f1" if len(second) == 1 else "f1m1"
+            return f"l{separator}{initials}", ORDER_AMBIGUOUS_WEIGHT
+        return None, 0
+
+    def classify_email(self, email: str):
+        """
+        Classifies a single email into a canonical pattern code.
+
+        Args:
+            email (str): The email address.
+
+        Returns:
+            tuple: The pattern code and the weight of the vote, or (None, 0) if the email cannot be classified.
+        """
+        tokens = self._tokenize(email)
+        if len(tokens) == 1:
+            return self._classify_single_token(tokens[0])
+        if len(tokens) == 3:
+            return self._classify_two_tokens(*tokens)
+        if len(tokens) == 5 and all(len(tokens[i]) >= 3 for i in (0, 2, 4)):
+            return f"f{tokens[1]}m{tokens[3]}l", 0.8
+        return None, 0
+
+    def infer(self, emails: list, prior_votes: Counter = None):
+        """
+        Votes on the pattern of a domain.
+
+        The confidence is the weight of the winning pattern divided by the number of classified emails, so the
+        weight a vote lacks (1 - weight) counts against the winner, and every unclassified email adds half a vote
+        against it. It is scaled down when the winning pattern has fewer than `min_votes` votes.
+
+        Args:
+            emails (list): A list of email strings.
+            prior_votes (Counter): Votes of already classified emails of the same domain, each counted with full weight.
+
+        Returns:
+            tuple: The most likely pattern code (or None) and its confidence between 0 and 1.
+        """
+        votes = Counter(prior_votes or {})
+        counts = Counter(prior_votes or {})
+        unclassified = 0
+        doubt = 0.0
+        for email in emails:
+            code, weight = self.classify_email(email)
+            if code is None:
+                unclassified += 1
+                continue
+            votes[code] += weight
+            counts[code] += 1
+            doubt += 1 - weight
+
+        if len(votes) == 0:
+            return None, 0.0
+
+        pattern, weight = votes.most_common(1)[0]
+        confidence = weight / (sum(votes.values()) + doubt + 0.5 * unclassified)
+        confidence *= min(1.0, counts[pattern] / self.min_votes)
+        return pattern, confidence
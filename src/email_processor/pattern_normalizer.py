@@ -0,0 +1,208 @@
+import re
+
+# Phrases the LLM uses to describe an email structure and the canonical code each one maps to.
+# Phrases in square brackets only match with their brackets (curly brackets are accepted too).
+PHRASE_CODES = {
+    "company domain": "",
+    "dot": ".",
+    "underscore": "_",
+    "dash": "-",
+    "hyphen": "-",
+    "[first name initials (2 initials)]": "f1m1",
+    "[first name initials (2)]": "f1m1",
+    "[first name initials (1 initial)]": "f1",
+    "[first name initials (1)]": "f1",
+    "[first name initial (1 initial)]": "f1",
+    "[first name]": "f",
+    "[middle name]": "m",
+    "[last name]": "l",
+    "[first initial]": "f1",
+    "[last initial]": "l1",
+    "[number]": "",
+    "full first name": "f",
+    "full last name": "l",
+    "first name": "f",
+    "middle name": "m",
+    "last name": "l",
+    "first name initial": "f1",
+    "last name initial": "l1",
+    "first initial": "f1",
+    "last initial": "l1",
+    "first letter of last name": "l1",
+    "first letter of first name": "f1",
+    "first initial of last name": "l1",
+    "first initial of first name": "f1",
+    "first": "f",
+    "last": "l",
+}
+
+# Single characters that are rewritten when they are not part of a phrase. Whitespace is dropped as well.
+CHARACTER_CODES = {"+": "", ",": ".", "[": ".", "]": "", ".": ".", "_": "_", "-": "-"}
+
+SEPARATORS = {".", "_", "-"}
+
+
+class PatternNormalizer:
+    """
+    Maps the email structure described by the LLM (e.g. `[first name].[last name]@company.com`) to its canonical
+    code (`f.l`) in a single scan. Whitespace is removed and curly brackets become square ones first, so `first name`,
+    `firstname` and `{first name}` are all spelled the same. All phrases are then compiled into one regex built from a
+    character trie, which always prefers the longest phrase, so `first initial of last name` is matched before
+    `first initial` or `first` get a chance to. `code` only needs the regex split and a join, so it stays in C from
+    start to end, and `normalize` also returns the tokens. Results are memoized since the LLM repeats the same few
+    descriptions over and over.
+    """
+    def __init__(self, max_memo_size: int = 10000):
+        """
+        Initializes the normalizer.
+
+        Args:
+            max_memo_size (int): Maximum number of normalized descriptions kept in memory.
+        """
+        trie = {}
+        phrase_codes = {}
+        for phrase, code in PHRASE_CODES.items():
+            phrase = phrase.replace(" ", "")
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[None] = True
+            phrase_codes[phrase] = code
+
+        # One capturing group around every alternative, so re.split returns the unmatched text and the matches
+        # alternately without a Python call per match.
+        self._pattern = re.compile(rf"({self._trie_regex(trie)}|[+,\[\]._\-])")
+        # Every match is a phrase or a single character, so all of them are resolved here. Matches that add nothing
+        # to the code, such as [number] or +, resolve to no token.
+        self._match_codes = {**CHARACTER_CODES, **phrase_codes}
+        self._match_tokens = {}
+        for raw, value in self._match_codes.items():
+            self._match_tokens[raw] = ("separator" if value in SEPARATORS else "name", value) if value else None
+        self._memo = {}
+        self._code_memo = {}
+        self._max_memo_size = max_memo_size
+
+    def _trie_regex(self, node: dict):
+        """
+        Builds the regex of a node of the character trie. A node that ends a phrase makes the longer continuations
+        optional so the longest phrase always wins.
+
+        Args:
+            node (dict): The trie node, mapping characters to child nodes and None to True if a phrase ends there.
+
+        Returns:
+            str: The regex source matching every phrase below the node.
+        """
+        alternatives = []
+        for char in sorted(key for key in node if key is not None):
+            char_regex = re.escape(char)
+            child = node[char]
+            if any(key is not None for key in child):
+                continuation = self._trie_regex(child)
+                char_regex += f"(?:{continuation})?" if None in child else continuation
+            alternatives.append(char_regex)
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    def code(self, text: str):
+        """
+        Normalizes an email structure described by the LLM to its canonical code only, without the tokens.
+
+        Args:
+            text (str): The email structure, optionally followed by `@domain`.
+
+        Returns:
+            str or None: The canonical code, or None if there is no pattern or it is empty or longer than 9 characters.
+        """
+        if text in self._code_memo:
+            return self._code_memo[text]
+        code = self._scan_code(text)
+        if len(self._code_memo) >= self._max_memo_size:
+            self._code_memo.clear()
+        self._code_memo[text] = code
+        return code
+
+    def _scan_code(self, text: str):
+        """
+        Splits the text on the phrases and separators and joins their codes. Unmatched text maps to itself, it can
+        never be spelled like a phrase or a separator since those are always matched.
+        """
+        text = text.strip().lower()
+        if text == "none":
+            return None
+        pieces = self._pattern.split(self._clean(text))
+        # Separators left at either end come from dropped placeholders such as [number].
+        code = "".join(map(self._match_codes.get, pieces, pieces)).strip("._-")
+        return code if 0 < len(code) <= 9 else None
+
+    def _clean(self, text: str):
+        """
+        Drops the domain and the whitespace of a lower cased structure and turns curly brackets into square ones.
+        """
+        return "".join(text.split("@")[0].split()).replace("{", "[").replace("}", "]")
+
+    def normalize(self, text: str):
+        """
+        Normalizes an email structure described by the LLM.
+
+        Args:
+            text (str): The email structure, optionally followed by `@domain`.
+
+        Returns:
+            tuple: The canonical code (or None if there is no pattern or it is empty or longer than 9 characters) and the list
+                of (kind, value) tokens it is made of, where kind is "name", "separator" or "literal".
+        """
+        result = self._memo.get(text)
+        if result is None:
+            result = self._normalize(text)
+            if len(self._memo) >= self._max_memo_size:
+                self._memo.clear()
+            self._memo[text] = result
+        return result[0], list(result[1])
+
+    def _normalize(self, text: str):
+        """
+        Scans the text once, emitting a token for every phrase, separator and run of unmatched characters.
+        """
+        text = text.strip().lower()
+        if text == "none":
+            return None, ()
+
+        pieces = self._pattern.split(self._clean(text))
+        tokens = map(self._match_tokens.get, pieces[1::2])
+        literals = pieces[0::2]
+        if any(literals):
+            tokens = self._merge_literals(literals, tokens)
+        else:
+            #Every character was matched, which is the usual case, so only the empty matches need dropping
+            tokens = list(filter(None, tokens))
+
+        # Separators left at either end come from dropped placeholders such as [number].
+        while tokens and tokens[0][0] == "separator":
+            tokens.pop(0)
+        while tokens and tokens[-1][0] == "separator":
+            tokens.pop()
+
+        code = "".join([token[1] for token in tokens])
+        if len(code) == 0 or len(code) > 9:
+            return None, tuple(tokens)
+        return code, tuple(tokens)
+
+    def _merge_literals(self, literals: list, tokens):
+        """
+        Puts the unmatched text between the tokens back in place. Unmatched text is kept as one literal until a non
+        empty token follows it, so text around dropped placeholders stays one literal.
+        """
+        merged = []
+        literal = literals[0]
+        for token, following in zip(tokens, literals[1:]):
+            if token is not None:
+                if literal:
+                    merged.append(("literal", literal))
+                    literal = ""
+                merged.append(token)
+            literal += following
+        if literal:
+            merged.append(("literal", literal))
+        return merged
@@ -28,9 +28,20 @@ You have two headings to output:
 2. Comma seperated list of all email structures found: 
 3. Most frequently repeated email structure:
 
-Example 1:
-```
-Input Emails: ###
+{examples}
+
+Input Emails: 
+###
+{emails}
+###
+If you cannot identify any pattern in the given emails, then just output NONE in that section.
+Helpful Answer:
+"""
+)
+
+# Few-shot examples for chain 2. Only the ones closest to the input emails are put in {examples}, see few_shot.py
+second_prompt_examples = [
+"""Input Emails: ###
 serge.santamaria@ascometal.com
 louis-nicolas.hallez@ascometal.com
 etienne.archaud@ascometal.com
@@ -38,7 +49,8 @@ contact.achats.fournisseurs@ascometal.com
 alain.genta@ascometal.com
 ascometal@ascometal.com
 maxime.lazard@ascometal.com
-contact@ascometal.com ###
+contact@ascometal.com
+###
 
 Individual email analysis one by one:
 -Email address: serge.santamaria@ascometal.com
@@ -66,13 +78,8 @@ Individual email analysis one by one:
 -Email structure: contact@ascometal.com
 
 Comma seperated list of all email structures found in order: [[first name].[last name]@ascometal.com, [first name]-[middle name].[last name]@ascometal.com]
-Most frequently repeated email structure:  [first name].[last name]@ascometal.com
-```
-
-Example 2:
-```
-Input Emails: 
-###
+Most frequently repeated email structure:  [first name].[last name]@ascometal.com""",
+"""Input Emails: ###
 m.oskar@company_domain.com
 oskar@company_domain.com
 oskarmartinez@company_domain.com
@@ -97,12 +104,8 @@ Individual email analysis one by one:
 -Email structure: [firstname].[last name]@company_domain.com
 
 Comma seperated list of all email structures found in order: [[first name initials (1)].[last name]@company_domain.com, [firstname]@company_domain.com, [firstname].[last name]@company_domain.com]
-Most frequently repeated email structure: [firstname].[last name]@company_domain.com
-```
-
-Example 3:```
-Input Emails: 
-###
+Most frequently repeated email structure: [firstname].[last name]@company_domain.com""",
+"""Input Emails: ###
 +astrid.winkler@t-online.de
 +hubert.hentschel@t-online.de
 +dr.merkelbach@t-online.de
@@ -135,12 +138,8 @@ Individual email analysis one by one:
 -Email structure: [firstname][lastname]@t-online.de
 
 Comma seperated list of all email structures found: [[first name].[last name]@t-online.de,  [title].[last name]@t-online.de, [firstname][lastname]@t-online.de, [first name]-[last name]@t-online.de, [firstname][lastname]@t-online.de]
-Most frequently repeated email structure:  [firstname].[last name]@company_domain.com
-```
-
-Example 4:```
-Input Emails: 
-###
+Most frequently repeated email structure:  [firstname].[last name]@company_domain.com""",
+"""Input Emails: ###
 matthias.mack@severstal.com
 christoph.massner@severstal.com
 ay.lohanov@severstal.com
@@ -217,11 +216,8 @@ Individual email analysis one by one:
 -Email structure: [first name initials (2 initials)].[last name]@severstal.com
 
 Comma seperated list of all email structures found: [[first name initials (2 initials)].[last name]@severstal.com, [first name].[last name]@severstal.com, [first name initial (1 initial)][last name]@severstal.com]
-Most frequently repeated email structure: [first name initials (2 initials)].[last name]@severstal.com
-```
-
-Example 4:```
-Input Emails: ###
+Most frequently repeated email structure: [first name initials (2 initials)].[last name]@severstal.com""",
+"""Input Emails: ###
 kamynina_ei2@nlmk.com
 rimskaya_aa@nlmk.com
 zatsepina_ty@nlmk.com
@@ -258,11 +254,8 @@ Individual email analysis one by one:
 -Email structure: [last name]_[first name initials (2 initials)]@nlmk.com
 
 Comma seperated list of all email structures found: [last name]_[first name initials (2 initials)]@nlmk.com, [last name]_[first name initials (2 initials)][number]@nlmk.com
-Most frequently repeated email structure: [last name]_[first name initials (2 initials)]@nlmk.com
-```
-
-Example 4:```
-Input Emails: ###
+Most frequently repeated email structure: [last name]_[first name initials (2 initials)]@nlmk.com""",
+"""Input Emails: ###
 karriere@salzgitter-ag.com
 alsmannm@salzgitter-ag.com
 ###
@@ -275,11 +268,8 @@ Individual email analysis one by one:
 -Email structure: [last name]@salzgitter-ag.com
 
 Comma seperated list of all email structures found: [last name]@salzgitter-ag.com
-Most frequently repeated email structure: [last name]@salzgitter-ag.com
-```
-
-Example 5:```
-Input Emails: ###
+Most frequently repeated email structure: [last name]@salzgitter-ag.com""",
+"""Input Emails: ###
 bobansrsc@hbisserbia.rs
 dlovre@hbisserbia.rs
 vgergulov@hbisserbia.rs
@@ -352,10 +342,8 @@ Individual email analysis one by one:
 -Email structure: [first name][last name]@hbisserbia.rs
 
 Comma seperated list of all email structures found: [first name initials (1 initial)][last name]@hbisserbia.rs, [first name][last name]@hbisserbia.rs, [first name initials (1 initial)].[last name]@hbisserbia.rs
-Most frequently repeated email structure: [first name initials (1 initial)][last name]@hbisserbia.rs
-```
-Example 6:```
-Input Emails: ###
+Most frequently repeated email structure: [first name initials (1 initial)][last name]@hbisserbia.rs""",
+"""Input Emails: ###
 jpfisterer@ms-stahlhandel.at
 nlobner@ms-stahlhandel.at
 ascheuchenpflug@ms-stahlhandel.at
@@ -388,17 +376,8 @@ Individual email analysis one by one:
 -Email structure: [first name initials (1 initial)][last name]@ms-stahlhandel.at
 
 Comma separated list of all email structures found: [first name initials (2 initials)][last name]@ms-stahlhandel.at, [first name initials (1 initial)][last name]@ms-stahlhandel.at
-Most frequently repeated email structure: [first name initials (1 initial)][last name]@ms-stahlhandel.at
-```
-
-Input Emails: 
-###
-{emails}
-###
-If you cannot identify any pattern in the given emails, then just output NONE in that section.
-Helpful Answer:
-"""
-)
+Most frequently repeated email structure: [first name initials (1 initial)][last name]@ms-stahlhandel.at""",
+]
 
 
 from langchain.prompts import PromptTemplate
@@ -415,4 +394,102 @@ Email structure analysis: ```
 """
 
 input_vars = ["structure"]
-third_prompt = PromptTemplate(input_variables=input_vars, template=third_prompt_template)
\ No newline at end of file
+third_prompt = PromptTemplate(input_variables=input_vars, template=third_prompt_template)
+
+# Batched chains, used to pack several small domains into one request
+batch_first_prompt = ChatPromptTemplate.from_template(
+"""
+Companies usually give their employees their own company email when they join. These emails are usually built using the names of the employees. For example, if the employee name is oskar martinez, his email could of the form: oskar@company_domain.com, oskarmartinez@company_domain.com, o.martinez@company_domain.com, m.oskar@company_domain.com, moskar@company_domain.com, and omartinez@company_domain.com
+Below are the email addresses of several companies. The emails of every company are in their own section, which starts with a header line such as === DOMAIN 1 === and ends with a line such as === END DOMAIN 1 ===.
+For every section, you have to identify all the email addresses that have the names of the employee in them in some form. The names in the emails can be from any language.
+Any generic email address that have the name of a product, job title, country or department etc such as sales@sama.bs.it, xxx@sama.bs.it, mexico@marcegaglia.com, financial@ibm.co.uk, director@ibm.co.uk are not required since we only trying to analyze emails with employee's personal name in it.
+
+For every section, output its header line followed by the email addresses of that section that you believe to have the names of company employees in them, one per line. If a section has no such email addresses then just output NONE under its header.
+Output the header of every section, in order, and do not output anything else.
+
+Input sections:
+{sections}
+
+Helpful Answer:
+"""
+)
+
+batch_second_prompt = ChatPromptTemplate.from_template(
+"""
+Companies usually have a pattern with which they make the emails of their employees when they join. It is related to the names of the employees.
+Below are the employee emails of several companies. The emails of every company are in their own section, which starts with a header line such as === DOMAIN 1 === and ends with a line such as === END DOMAIN 1 ===.
+For every section, analyze the pattern of each email individually and then find the most commonly found pattern among the emails of that section.
+
+For every section, output its header line followed by:
+Individual email analysis one by one:
+-Email address:
+-Email structure:
+Most frequently repeated email structure:
+
+Example:```
+Input sections:
+=== DOMAIN 1 ===
+serge.santamaria@ascometal.com
+etienne.archaud@ascometal.com
+louis-nicolas.hallez@ascometal.com
+=== END DOMAIN 1 ===
+
+=== DOMAIN 2 ===
+ay.lohanov@severstal.com
+as.rogachev@severstal.com
+=== END DOMAIN 2 ===
+
+Helpful Answer:
+=== DOMAIN 1 ===
+Individual email analysis one by one:
+-Email address: serge.santamaria@ascometal.com
+-Email structure: [first name].[last name]@ascometal.com
+
+-Email address: etienne.archaud@ascometal.com
+-Email structure: [first name].[last name]@ascometal.com
+
+-Email address: louis-nicolas.hallez@ascometal.com
+-Email structure: [first name]-[middle name].[last name]@ascometal.com
+
+Most frequently repeated email structure: [first name].[last name]@ascometal.com
+
+=== DOMAIN 2 ===
+Individual email analysis one by one:
+-Email address: ay.lohanov@severstal.com
+-Email structure: [first name initials (2 initials)].[last name]@severstal.com
+
+-Email address: as.rogachev@severstal.com
+-Email structure: [first name initials (2 initials)].[last name]@severstal.com
+
+Most frequently repeated email structure: [first name initials (2 initials)].[last name]@severstal.com
+```
+
+Input sections:
+{sections}
+
+Output the header of every section, in order. If you cannot identify any pattern in the emails of a section, then just output NONE as its most frequently repeated email structure.
+Helpful Answer:
+"""
+)
+
+
+# Single call structured chain, which filters the emails and describes their structures in one JSON answer
+structured_prompt = ChatPromptTemplate.from_template(
+"""
+Companies usually give their employees their own company email when they join. These emails are usually built using the names of the employees. For example, if the employee name is oskar martinez, his email could of the form: oskar@company_domain.com, oskarmartinez@company_domain.com, o.martinez@company_domain.com, m.oskar@company_domain.com, moskar@company_domain.com, and omartinez@company_domain.com
+Given a list of emails delimited by triple backticks, do the following:
+1. Identify all the email addresses that have the names of the employee in them in some form. The names in the emails can be from any language. Any generic email address that have the name of a product, job title, country or department etc such as sales@sama.bs.it, mexico@marcegaglia.com, financial@ibm.co.uk, director@ibm.co.uk are not required.
+2. For every identified email address, give its structure using the placeholders [first name], [middle name], [last name], [first name initial (1 initial)], [first name initials (2 initials)] and [last initial], for example [first name].[last name]@company_domain.com
+3. Find the most commonly found structure among the identified email addresses.
+
+Respond with a single JSON object and nothing else, in this format:
+{{"personal_emails": ["oskar.martinez@company_domain.com"], "structures": [{{"email": "oskar.martinez@company_domain.com", "structure": "[first name].[last name]@company_domain.com"}}], "majority_pattern": "[first name].[last name]@company_domain.com"}}
+
+If none of the emails have the names of employees in them, respond with:
+{{"personal_emails": [], "structures": [], "majority_pattern": "NONE"}}
+
+Input emails: ``` {emails} ```
+
+JSON answer:
+"""
+)
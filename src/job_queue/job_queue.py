@@ -0,0 +1,307 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from src.logger import logging
+
+
+class JobQueue:
+    """
+    A durable local job queue backed by SQLite. Every job is split into items (one per domain or company) that are
+    claimed, processed and checkpointed one by one, so a restart only redoes the items that were in flight.
+    """
+    def __init__(self, path: str, max_attempts: int = 3, stale_timeout: float = 900):
+        """
+        Initializes the queue and creates its tables if needed.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            max_attempts (int): Number of times an item is tried before it is marked as failed.
+            stale_timeout (float): Number of seconds after which a claimed item that never finished is claimed again.
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.stale_timeout = stale_timeout
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, type TEXT NOT NULL, status TEXT NOT NULL, total INTEGER NOT NULL, "
+                "completed INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS job_items ("
+                "job_id TEXT NOT NULL, position INTEGER NOT NULL, key TEXT NOT NULL, payload TEXT NOT NULL, "
+                "status TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "owner INTEGER, claimed_at REAL, seq INTEGER, finished_seq INTEGER, PRIMARY KEY (job_id, position))"
+            )
+            self._migrate(connection)
+            #seq orders the pending items for claiming, finished_seq orders the finished items of a job for paging
+            connection.execute("CREATE INDEX IF NOT EXISTS job_items_pending ON job_items (status, seq)")
+            connection.execute("CREATE INDEX IF NOT EXISTS job_items_status ON job_items (status, claimed_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS job_items_finished ON job_items (job_id, finished_seq)")
+
+    def _migrate(self, connection):
+        """
+        Adds the seq and finished_seq columns to a queue created by an older version and fills them in.
+        """
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(job_items)")}
+        if "seq" not in columns:
+            connection.execute("ALTER TABLE job_items ADD COLUMN seq INTEGER")
+            connection.execute("UPDATE job_items SET seq = rowid")
+        if "finished_seq" not in columns:
+            connection.execute("ALTER TABLE job_items ADD COLUMN finished_seq INTEGER")
+            connection.execute(
+                "UPDATE job_items SET finished_seq = ("
+                "SELECT COUNT(*) FROM job_items AS earlier WHERE earlier.job_id = job_items.job_id "
+                "AND earlier.status IN ('done', 'failed') AND earlier.position <= job_items.position) "
+                "WHERE status IN ('done', 'failed')"
+            )
+
+    def _connect(self):
+        """
+        Opens a connection. Connections are short lived so the queue can be used from worker threads.
+        """
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return _ClosingConnection(connection)
+
+    def submit(self, job_type: str, items: dict):
+        """
+        Adds a job to the queue.
+
+        Args:
+            job_type (str): The type of the job, which selects the processor that runs its items.
+            items (dict): A mapping of item keys (domains, company names) to their payload.
+
+        Returns:
+            str: The id of the job.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT INTO jobs (id, type, status, total, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, job_type, "queued" if items else "done", len(items), now, now),
+            )
+            connection.executemany(
+                "INSERT INTO job_items (job_id, position, key, payload, status) VALUES (?, ?, ?, ?, 'pending')",
+                ((job_id, position, key, json.dumps(payload)) for position, (key, payload) in enumerate(items.items())),
+            )
+            #The rowid grows with every insert, so items are claimed oldest job first
+            connection.execute("UPDATE job_items SET seq = rowid WHERE job_id = ?", (job_id,))
+            connection.execute("COMMIT")
+        logging.info(f"Queued job {job_id} of type {job_type} with {len(items)} items")
+        return job_id
+
+    def claim(self, count: int = 1):
+        """
+        Claims pending items for this process, oldest job first. Items whose claim went stale are claimed again first,
+        or marked as failed if they ran out of attempts, so an item whose handler hangs cannot be reclaimed forever.
+
+        Args:
+            count (int): The maximum number of items to claim.
+
+        Returns:
+            list: (job_id, position, job_type, key, payload) tuples.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = []
+            stale_rows = connection.execute(
+                "SELECT job_id, position, key, payload, attempts FROM job_items "
+                "WHERE status = 'running' AND claimed_at < ? ORDER BY claimed_at LIMIT ?",
+                (now - self.stale_timeout, count),
+            ).fetchall()
+            for job_id, position, key, payload, attempts in stale_rows:
+                if attempts < self.max_attempts:
+                    rows.append((job_id, position, key, payload))
+                else:
+                    self._finish_item(connection, job_id, position, "failed", None,
+                                      f"Timed out after {attempts} attempts", now)
+            if stale_rows:
+                logging.warning(f"Claimed {len(rows)} stale job items again, failed {len(stale_rows) - len(rows)} out of attempts")
+            if len(rows) < count:
+                rows += connection.execute(
+                    "SELECT job_id, position, key, payload FROM job_items WHERE status = 'pending' ORDER BY seq LIMIT ?",
+                    (count - len(rows),),
+                ).fetchall()
+            connection.executemany(
+                "UPDATE job_items SET status = 'running', owner = ?, claimed_at = ?, attempts = attempts + 1 "
+                "WHERE job_id = ? AND position = ?",
+                ((os.getpid(), now, job_id, position) for job_id, position, _, _ in rows),
+            )
+            job_types = {}
+            for job_id in {row[0] for row in rows}:
+                job_types[job_id] = connection.execute("SELECT type FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'", (now, job_id)
+                )
+            connection.execute("COMMIT")
+        return [(job_id, position, job_types[job_id], key, json.loads(payload)) for job_id, position, key, payload in rows]
+
+    def complete(self, job_id: str, position: int, result):
+        """
+        Checkpoints the result of an item.
+
+        Args:
+            job_id (str): The id of the job.
+            position (int): The position of the item in the job.
+            result: The JSON serializable result of the item.
+        """
+        self._finish(job_id, position, "done", json.dumps(result), None)
+
+    def fail(self, job_id: str, position: int, error: str):
+        """
+        Records a failed attempt of an item. The item goes back to the queue until it runs out of attempts.
+
+        Args:
+            job_id (str): The id of the job.
+            position (int): The position of the item in the job.
+            error (str): The error message.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            #An item that is no longer running was finished or failed by a stale claim in the meantime
+            row = connection.execute(
+                "SELECT attempts FROM job_items WHERE job_id = ? AND position = ? AND status = 'running'", (job_id, position)
+            ).fetchone()
+            if row is not None and row[0] < self.max_attempts:
+                connection.execute(
+                    "UPDATE job_items SET status = 'pending', error = ?, owner = NULL, claimed_at = NULL "
+                    "WHERE job_id = ? AND position = ? AND status = 'running'",
+                    (error, job_id, position),
+                )
+            elif row is not None:
+                self._finish_item(connection, job_id, position, "failed", None, error, time.time())
+            connection.execute("COMMIT")
+
+    def _finish(self, job_id: str, position: int, status: str, result: str, error: str):
+        """
+        Marks an item as done or failed and updates the progress of its job.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self._finish_item(connection, job_id, position, status, result, error, time.time())
+            connection.execute("COMMIT")
+
+    def _finish_item(self, connection, job_id: str, position: int, status: str, result: str, error: str, now: float):
+        """
+        Marks a running item as done or failed and updates the progress of its job, inside the caller's transaction.
+        """
+        updated = connection.execute(
+            "UPDATE job_items SET status = ?, result = ?, error = ?, "
+            "finished_seq = (SELECT completed + failed + 1 FROM jobs WHERE id = ?) "
+            "WHERE job_id = ? AND position = ? AND status = 'running'",
+            (status, result, error, job_id, job_id, position),
+        ).rowcount
+        if updated:
+            column = "completed" if status == "done" else "failed"
+            connection.execute(
+                f"UPDATE jobs SET {column} = {column} + 1, updated_at = ?, "
+                "status = CASE WHEN completed + failed + 1 >= total THEN 'done' ELSE status END WHERE id = ?",
+                (now, job_id),
+            )
+
+    def recover(self):
+        """
+        Puts the items claimed by processes that are no longer running back in the queue, so a restart resumes
+        the jobs where they stopped.
+
+        Returns:
+            int: The number of items put back.
+        """
+        recovered = 0
+        with self._connect() as connection:
+            owners = [row[0] for row in connection.execute("SELECT DISTINCT owner FROM job_items WHERE status = 'running'")]
+            for owner in owners:
+                if owner is not None and owner != os.getpid() and _process_is_running(owner):
+                    continue
+                recovered += connection.execute(
+                    "UPDATE job_items SET status = 'pending', owner = NULL, claimed_at = NULL, attempts = MAX(attempts - 1, 0) "
+                    "WHERE status = 'running' AND owner IS ?",
+                    (owner,),
+                ).rowcount
+        if recovered:
+            logging.info(f"Recovered {recovered} interrupted job items")
+        return recovered
+
+    def status(self, job_id: str):
+        """
+        Returns the progress of a job.
+
+        Args:
+            job_id (str): The id of the job.
+
+        Returns:
+            dict or None: The job's type, status and item counts, or None if the job does not exist.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT type, status, total, completed, failed, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_type, status, total, completed, failed, created_at, updated_at = row
+        return {"job_id": job_id, "type": job_type, "status": status, "total": total, "completed": completed,
+                "failed": failed, "created_at": created_at, "updated_at": updated_at}
+
+    def results(self, job_id: str, after: int = 0, limit: int = 1000):
+        """
+        Returns the results of the finished items of a job, in the order they finished. Items only ever finish after
+        the ones already returned, so polling with the returned cursor never skips or repeats an item.
+
+        Args:
+            job_id (str): The id of the job.
+            after (int): The cursor returned by the previous page, 0 for the first page.
+            limit (int): The maximum number of items to return.
+
+        Returns:
+            tuple: A mapping of item keys to their result, where failed items map to None, and the cursor of the next page.
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT key, result, finished_seq FROM job_items WHERE job_id = ? AND finished_seq > ? "
+                "ORDER BY finished_seq LIMIT ?",
+                (job_id, after, limit),
+            ).fetchall()
+        results = {key: json.loads(result) if result is not None else None for key, result, _ in rows}
+        return results, rows[-1][2] if rows else after
+
+
+class _ClosingConnection:
+    """
+    Context manager that closes a SQLite connection on exit and rolls back an open transaction on errors.
+    """
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __enter__(self):
+        return self._connection
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._connection.in_transaction:
+            self._connection.execute("ROLLBACK")
+        self._connection.close()
+
+
+def _process_is_running(pid: int):
+    """
+    Checks if a process with the given id is running on this host.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
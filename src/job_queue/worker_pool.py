@@ -0,0 +1,85 @@
+import asyncio
+
+from src.job_queue.job_queue import JobQueue
+from src.logger import logging
+
+
+class JobWorkerPool:
+    """
+    A pool of asyncio workers that claim items from the job queue, run them with the processor registered for their
+    job type and checkpoint every result as soon as it is ready.
+    """
+    def __init__(self, queue: JobQueue, handlers: dict, concurrency: int = 20, poll_interval: float = 1.0):
+        """
+        Initializes the pool.
+
+        Args:
+            queue (JobQueue): The job queue.
+            handlers (dict): A mapping of job types to coroutine functions that take an item key and its payload. A
+                handler must raise on errors rather than return a fallback, so the item is retried and then failed.
+            concurrency (int): The number of items processed at the same time.
+            poll_interval (float): The number of seconds an idle worker waits before looking for new items.
+        """
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._workers = []
+        self._claimed = []
+        self._claim_lock = asyncio.Lock()
+        self._busy = 0
+
+    def start(self):
+        """
+        Recovers the items interrupted by a previous run and starts the workers.
+        """
+        self.queue.recover()
+        logging.info(f"Starting {self.concurrency} job workers")
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """
+        Stops the workers. Items in flight or claimed but not started stay claimed and are recovered on the next start.
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._claimed = []
+
+    async def _next_item(self):
+        """
+        Returns the next claimed item, or None if the queue is empty. Items are claimed in one batch for all the
+        idle workers, so the queue is not locked once per item.
+        """
+        async with self._claim_lock:
+            if len(self._claimed) == 0:
+                try:
+                    self._claimed = await asyncio.to_thread(self.queue.claim, max(1, self.concurrency - self._busy))
+                except Exception as excep:
+                    logging.error(f"Error claiming job items: {excep}")
+            return self._claimed.pop(0) if self._claimed else None
+
+    async def _work(self):
+        """
+        Claims and runs items until the worker is cancelled.
+        """
+        while True:
+            item = await self._next_item()
+            if item is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            job_id, position, job_type, key, payload = item
+            self._busy += 1
+            try:
+                handler = self.handlers[job_type]
+                result = await handler(key, payload)
+                await asyncio.to_thread(self.queue.complete, job_id, position, result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as excep:
+                logging.error(f"Error running item {key} of job {job_id}: {excep}")
+                await asyncio.to_thread(self.queue.fail, job_id, position, str(excep))
+            finally:
+                self._busy -= 1
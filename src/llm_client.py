@@ -0,0 +1,247 @@
+import asyncio
+import random
+from typing import Any, List, Optional
+
+import aiohttp
+import openai
+from langchain.chat_models import ChatOpenAI
+from langchain.pydantic_v1 import Field
+from langchain.schema import AIMessage, ChatGeneration, ChatResult
+from tenacity import RetryCallState
+
+from src.logger import logging
+from src.metrics import LLMMetricsHandler
+from src.rate_limiter import get_rate_limiter
+from src.transcripts import TranscriptStore
+from src.utils import count_tokens
+
+# The errors worth another attempt, the same ones langchain retries on.
+RETRYABLE_ERRORS = (
+    openai.error.Timeout,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+)
+
+
+class RateLimitedChatOpenAI(ChatOpenAI):
+    """
+    A ChatOpenAI model whose async calls go through the process-wide rate limiter. Retries are done here rather than
+    inside langchain, so a call waiting to be retried does not hold a concurrency slot and every 429 reaches the
+    adaptive concurrency limit. Models created by an `LLMClientPool` send their requests over the pool's shared
+    keep-alive HTTP session instead of opening a new one per request. With a transcript store, completions are
+    recorded to it or replayed from it instead of calling the API.
+    """
+    rate_limiter: Any = Field(default=None, exclude=True)
+    client_pool: Any = Field(default=None, exclude=True)
+    transcripts: Any = Field(default=None, exclude=True)
+    limiter_key: Optional[str] = None
+    #One attempt per langchain call, the retries happen in `_agenerate`
+    max_retries: int = 1
+    retry_attempts: int = 6
+    backoff_base: float = 1.0
+    backoff_max: float = 60.0
+
+    def _estimate_tokens(self, messages: List):
+        """
+        Estimates the tokens a call counts against the quota: its prompt plus the completion tokens it reserves.
+        """
+        prompt_tokens = sum(count_tokens(str(message.content), self.model_name) + 4 for message in messages)
+        return prompt_tokens + (self.max_tokens or 0)
+
+    def get_num_tokens(self, text: str):
+        """
+        Counts the tokens of a text, as langchain does before reducing documents, with the cached encodings of
+        count_tokens instead of loading one per call.
+        """
+        return count_tokens(text, self.model_name)
+
+    def _retry_delay(self, excep: Exception, attempt: int):
+        """
+        Returns the number of seconds to wait before the next attempt: exponential backoff with jitter, and at
+        least the Retry-After of a rate limit error.
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        headers = getattr(excep, "headers", None) or {}
+        try:
+            return max(delay, float(headers.get("retry-after", 0)))
+        except (TypeError, ValueError):
+            return delay
+
+    def _replay(self, key: str):
+        """
+        Builds the result of a call from its recorded completion.
+        """
+        entry = self.transcripts.get(key)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=entry["completion"]))],
+                          llm_output=entry["llm_output"])
+
+    def _record(self, key: str, messages: List, stop: Optional[List[str]], result):
+        """
+        Records the prompt and completion of a call.
+        """
+        self.transcripts.record(key, self.model_name, messages, stop, result.generations[0].message.content,
+                                result.llm_output)
+
+    def _generate(self, messages: List, stop: Optional[List[str]] = None, run_manager=None,
+                  stream: Optional[bool] = None, **kwargs: Any):
+        if self.transcripts is None:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
+
+        key = self.transcripts.prompt_hash(self.model_name, messages, stop)
+        if self.transcripts.mode == "replay":
+            return self._replay(key)
+        result = super()._generate(messages, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
+        self._record(key, messages, stop, result)
+        return result
+
+    async def _agenerate(self, messages: List, stop: Optional[List[str]] = None, run_manager=None,
+                         stream: Optional[bool] = None, **kwargs: Any):
+        if self.transcripts is None:
+            return await self._agenerate_with_session(messages, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
+
+        key = self.transcripts.prompt_hash(self.model_name, messages, stop)
+        if self.transcripts.mode == "replay":
+            return self._replay(key)
+        result = await self._agenerate_with_session(messages, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
+        self._record(key, messages, stop, result)
+        return result
+
+    async def _agenerate_with_session(self, messages: List, stop: Optional[List[str]] = None, run_manager=None,
+                                      stream: Optional[bool] = None, **kwargs: Any):
+        """
+        Runs a call over the shared HTTP session of the pool, if the model has one.
+        """
+        if self.client_pool is None:
+            return await self._agenerate_with_limits(messages, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
+
+        #openai reuses the session found in this context variable, which only lives as long as this call's context
+        token = openai.aiosession.set(self.client_pool.session())
+        try:
+            return await self._agenerate_with_limits(messages, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
+        finally:
+            openai.aiosession.reset(token)
+
+    async def _agenerate_with_limits(self, messages: List, stop: Optional[List[str]] = None, run_manager=None,
+                                     stream: Optional[bool] = None, **kwargs: Any):
+        """
+        Runs a call under the rate limiter, retrying the errors worth another attempt.
+        """
+        if self.rate_limiter is None:
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
+
+        tokens = self._estimate_tokens(messages)
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                async with self.rate_limiter.limit(tokens, self.limiter_key):
+                    return await super()._agenerate(messages, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
+            except RETRYABLE_ERRORS as excep:
+                if attempt == self.retry_attempts:
+                    raise
+                delay = self._retry_delay(excep, attempt)
+                logging.warning(f"Retrying LLM call in {delay:.1f}s after {type(excep).__name__}: {excep}")
+                if run_manager is not None:
+                    state = RetryCallState(None, None, (), {})
+                    state.attempt_number = attempt
+                    state.set_exception((type(excep), excep, excep.__traceback__))
+                    await run_manager.on_retry(state)
+                await asyncio.sleep(delay)
+
+
+class LLMClientPool:
+    """
+    The factory of every LLM model of the process. All models share one rate limiter and one keep-alive HTTP
+    session, and every module and stage gets its own model so its parameters can be overridden and its calls are
+    measured separately.
+    """
+    def __init__(self, user_settings: dict):
+        """
+        Initializes the pool.
+
+        Args:
+            user_settings (dict): A dictionary containing user settings, including the OpenAI model name. The optional
+                key `llm_overrides` maps "module.stage" names (e.g. "email_processor.chain_two") to the model
+                parameters of that stage, `llm_connection_limit` and `llm_keepalive_timeout` size the connection pool,
+                and `llm_transcript_mode` ("record" or "replay") with `llm_transcript_path` records or replays every
+                completion, see TranscriptStore.
+        """
+        self.model_name = user_settings["openAI_model_name"]
+        self.overrides = user_settings.get("llm_overrides", {})
+        self.connection_limit = user_settings.get("llm_connection_limit", 100)
+        self.keepalive_timeout = user_settings.get("llm_keepalive_timeout", 60)
+        self.rate_limiter = get_rate_limiter(user_settings)
+        self.transcripts = None
+        if user_settings.get("llm_transcript_mode"):
+            self.transcripts = TranscriptStore(user_settings.get("llm_transcript_path", "transcripts/llm_transcripts.jsonl.gz"),
+                                               user_settings["llm_transcript_mode"])
+        self._clients = {}
+        self._session = None
+        self._session_loop = None
+
+    def get(self, module: str, stage: str, **params):
+        """
+        Returns the model of a stage, creating it on first use.
+
+        Args:
+            module (str): The module making the calls, e.g. "translator".
+            stage (str): The stage of the module, e.g. "translation".
+            **params: The default model parameters of the stage, e.g. max_tokens. Overrides in the settings win.
+
+        Returns:
+            RateLimitedChatOpenAI: The model of the stage.
+        """
+        name = f"{module}.{stage}"
+        if name not in self._clients:
+            settings = {"model_name": self.model_name, "temperature": 0, **params, **self.overrides.get(name, {})}
+            logging.info(f"Creating LLM client for {name} with {settings}")
+            self._clients[name] = RateLimitedChatOpenAI(
+                **settings,
+                rate_limiter=self.rate_limiter,
+                client_pool=self,
+                transcripts=self.transcripts,
+                limiter_key=name,
+                callbacks=[LLMMetricsHandler(module, stage)],
+            )
+        return self._clients[name]
+
+    def session(self):
+        """
+        Returns the shared HTTP session, opening it on first use in the running event loop.
+
+        Returns:
+            aiohttp.ClientSession: The session.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        """
+        Closes the shared HTTP session.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_shared_pool = None
+
+def get_llm_pool(user_settings: dict):
+    """
+    Returns the LLM client pool shared by every processor of the process, creating it from the user settings on
+    first use.
+
+    Args:
+        user_settings (dict): A dictionary containing user settings.
+
+    Returns:
+        LLMClientPool: The shared pool.
+    """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = LLMClientPool(user_settings)
+    return _shared_pool
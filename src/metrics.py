@@ -0,0 +1,225 @@
+import threading
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+class _Metric:
+    """
+    A metric with a fixed set of label names. Every combination of label values is a separate series.
+    """
+    kind = None
+
+    def __init__(self, name: str, description: str, label_names: tuple = ()):
+        """
+        Initializes the metric.
+
+        Args:
+            name (str): The name of the metric.
+            description (str): The help text of the metric.
+            label_names (tuple): The names of the labels of every series.
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _format_labels(self, labels: tuple, extra: dict = None):
+        """
+        Formats label values as `{name="value",...}`, or an empty string if there are no labels.
+        """
+        pairs = list(zip(self.label_names, labels)) + list((extra or {}).items())
+        if len(pairs) == 0:
+            return ""
+        escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in pairs]
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def _samples(self):
+        """
+        Returns the (suffix, label string, value) samples of every series.
+        """
+        with self._lock:
+            return [("", self._format_labels(labels), value) for labels, value in sorted(self._series.items())]
+
+    def render(self):
+        """
+        Renders the metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The HELP and TYPE lines followed by one line per sample.
+        """
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {value:g}" for suffix, labels, value in self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, e.g. the number of tokens sent.
+    """
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def total(self):
+        """
+        Returns the sum of every series.
+        """
+        with self._lock:
+            return sum(self._series.values())
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, e.g. the number of requests in flight.
+    """
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._series[labels] = value
+
+
+class Histogram(_Metric):
+    """
+    A distribution of observed values counted in cumulative buckets, e.g. request latencies.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: tuple = (), buckets: tuple = None):
+        """
+        Initializes the histogram.
+
+        Args:
+            name (str): The name of the metric.
+            description (str): The help text of the metric.
+            label_names (tuple): The names of the labels of every series.
+            buckets (tuple): The upper bounds of the buckets, in increasing order.
+        """
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets or (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 40, 60, 120))
+
+    def observe(self, *labels, value: float):
+        with self._lock:
+            counts, total, count = self._series.get(labels, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[labels] = (counts, total + value, count + 1)
+
+    def _samples(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._series.items())
+        samples = []
+        for labels, (counts, total, count) in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append(("_bucket", self._format_labels(labels, {"le": f"{bound:g}"}), bucket_count))
+            samples.append(("_bucket", self._format_labels(labels, {"le": "+Inf"}), count))
+            samples.append(("_sum", self._format_labels(labels), total))
+            samples.append(("_count", self._format_labels(labels), count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    The process-wide collection of metrics exposed by the `/metrics` endpoint.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric):
+        """
+        Adds a metric to the registry.
+
+        Args:
+            metric (_Metric): The metric.
+
+        Returns:
+            _Metric: The same metric, so it can be defined and registered in one line.
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text.
+        """
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+LLM_LATENCY = REGISTRY.register(Histogram("analysis_llm_stage_latency_seconds", "Latency of LLM calls per module and stage.", ("module", "stage")))
+LLM_TOKENS = REGISTRY.register(Counter("analysis_llm_tokens_total", "Tokens used by LLM calls per module, stage and kind (prompt or completion).", ("module", "stage", "kind")))
+LLM_IN_FLIGHT = REGISTRY.register(Gauge("analysis_llm_in_flight_requests", "LLM calls currently waiting for an answer.", ("module", "stage")))
+LLM_ERRORS = REGISTRY.register(Counter("analysis_llm_errors_total", "LLM calls that failed after all retries.", ("module", "stage")))
+LLM_RETRIES = REGISTRY.register(Counter("analysis_llm_retries_total", "Retries of failed LLM calls.", ("module", "stage")))
+CACHE_REQUESTS = REGISTRY.register(Counter("analysis_cache_requests_total", "Cache lookups per namespace and result (hit or miss).", ("namespace", "result")))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge("analysis_cache_hit_ratio", "Share of cache lookups answered from the cache since startup.", ("namespace",)))
+HTTP_LATENCY = REGISTRY.register(Histogram("analysis_http_request_latency_seconds", "Latency of API requests per path.", ("path",)))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge("analysis_http_in_flight_requests", "API requests currently being served per path.", ("path",)))
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """
+    A langchain callback handler that records the latency, token usage, in-flight count, errors and retries of the
+    LLM calls of one stage of a module.
+    """
+    #Metrics are cheap to record so there is no need to hand the events to a thread pool
+    run_inline = True
+
+    def __init__(self, module: str, stage: str):
+        """
+        Initializes the handler.
+
+        Args:
+            module (str): The module making the calls, e.g. "email_processor".
+            stage (str): The stage of the module, e.g. "chain_one".
+        """
+        self.module = module
+        self.stage = stage
+        self._started = {}
+
+    def _start(self, run_id):
+        self._started[run_id] = time.perf_counter()
+        LLM_IN_FLIGHT.inc(self.module, self.stage)
+
+    def _finish(self, run_id):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        LLM_IN_FLIGHT.dec(self.module, self.stage)
+        LLM_LATENCY.observe(self.module, self.stage, value=time.perf_counter() - started)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+        token_usage = (response.llm_output or {}).get("token_usage", {})
+        LLM_TOKENS.inc(self.module, self.stage, "prompt", amount=token_usage.get("prompt_tokens", 0))
+        LLM_TOKENS.inc(self.module, self.stage, "completion", amount=token_usage.get("completion_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+        LLM_ERRORS.inc(self.module, self.stage)
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        LLM_RETRIES.inc(self.module, self.stage)
+
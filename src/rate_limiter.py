@@ -0,0 +1,158 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import openai
+from aiolimiter import AsyncLimiter
+
+from src.logger import logging
+from src.metrics import REGISTRY, Counter, Gauge
+
+LIMITER_CONCURRENCY = REGISTRY.register(Gauge("analysis_llm_concurrency_limit", "Current adaptive limit of concurrent LLM calls."))
+LIMITER_THROTTLES = REGISTRY.register(Counter("analysis_llm_throttled_total", "LLM calls rejected by the API with a 429 rate limit error."))
+
+
+class AdaptiveConcurrency:
+    """
+    An AIMD (additive increase, multiplicative decrease) limit on the number of calls in flight. Every successful
+    call grows the limit by 1/limit, so it grows by about one per round of calls, and a throttled call or a latency
+    spike halves it. Decreases are at most once per `cooldown` seconds so one burst of 429s only counts once.
+    Latency is averaged per kind of call, since a short classification and a long summary are not comparable.
+    """
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_spike_factor: float = 3.0, cooldown: float = 5.0):
+        """
+        Initializes the limit.
+
+        Args:
+            initial (int): The limit to start with.
+            minimum (int): The lowest value the limit is decreased to.
+            maximum (int): The highest value the limit is increased to.
+            latency_spike_factor (float): A call slower than this many times the average latency counts as a spike.
+            cooldown (float): The minimum number of seconds between two decreases.
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_spike_factor = latency_spike_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._average_latency = {}
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+        LIMITER_CONCURRENCY.set(value=self.limit)
+
+    async def acquire(self):
+        """
+        Waits until a call can start under the current limit.
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float, throttled: bool = False, key: str = None):
+        """
+        Ends a call and adapts the limit to how it went.
+
+        Args:
+            latency (float): The number of seconds the call took.
+            throttled (bool): True if the API rejected the call with a rate limit error.
+            key (str): The kind of call, e.g. its module and stage, whose average latency the call is compared to.
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            average = self._average_latency.get(key)
+            spike = average is not None and latency > self.latency_spike_factor * average
+            if throttled or spike:
+                self._decrease("rate limited" if throttled else f"latency spike of {latency:.1f}s")
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                #Only successful calls update the average, so throttled calls do not hide the next spike
+                self._average_latency[key] = latency if average is None else 0.9 * average + 0.1 * latency
+            LIMITER_CONCURRENCY.set(value=self.limit)
+            self._condition.notify_all()
+
+    def _decrease(self, reason: str):
+        """
+        Halves the limit unless it was already decreased less than `cooldown` seconds ago.
+        """
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        logging.warning(f"Lowering LLM concurrency to {int(self.limit)} after {reason}")
+
+
+class RateLimiter:
+    """
+    The process-wide limiter of OpenAI calls. Calls are paced to stay under the requests per minute and tokens per
+    minute quotas, and the number of calls in flight follows an adaptive AIMD limit.
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, concurrency: AdaptiveConcurrency):
+        """
+        Initializes the limiter.
+
+        Args:
+            requests_per_minute (int): The requests per minute quota.
+            tokens_per_minute (int): The tokens per minute quota.
+            concurrency (AdaptiveConcurrency): The limit of calls in flight.
+        """
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = AsyncLimiter(requests_per_minute, 60)
+        self._tokens = AsyncLimiter(tokens_per_minute, 60)
+        self.concurrency = concurrency
+
+    @asynccontextmanager
+    async def limit(self, tokens: int, key: str = None):
+        """
+        Waits for quota and a concurrency slot, then runs the body of the `async with` block as one call. An
+        `openai.error.RateLimitError` raised in the block is reported as a throttled call.
+
+        Args:
+            tokens (int): The number of tokens the call counts against the tokens per minute quota.
+            key (str): The kind of call, used to detect latency spikes.
+        """
+        await self._requests.acquire()
+        await self._tokens.acquire(min(tokens, self.tokens_per_minute))
+        await self.concurrency.acquire()
+        start = time.perf_counter()
+        throttled = False
+        try:
+            yield
+        except openai.error.RateLimitError:
+            throttled = True
+            LIMITER_THROTTLES.inc()
+            raise
+        finally:
+            await self.concurrency.release(time.perf_counter() - start, throttled, key)
+
+
+_shared_limiter = None
+
+def get_rate_limiter(user_settings: dict):
+    """
+    Returns the rate limiter shared by every processor of the process, creating it from the user settings on
+    first use.
+
+    Args:
+        user_settings (dict): A dictionary containing user settings. The optional keys `openai_requests_per_minute`,
+            `openai_tokens_per_minute`, `llm_initial_concurrency`, `llm_min_concurrency` and `llm_max_concurrency`
+            set the quotas and the bounds of the adaptive concurrency.
+
+    Returns:
+        RateLimiter: The shared limiter.
+    """
+    global _shared_limiter
+    if _shared_limiter is None:
+        concurrency = AdaptiveConcurrency(
+            user_settings.get("llm_initial_concurrency", 8),
+            user_settings.get("llm_min_concurrency", 1),
+            user_settings.get("llm_max_concurrency", 64),
+            latency_spike_factor=user_settings.get("llm_latency_spike_factor", 3.0),
+        )
+        _shared_limiter = RateLimiter(
+            user_settings.get("openai_requests_per_minute", 3500),
+            user_settings.get("openai_tokens_per_minute", 90000),
+            concurrency,
+        )
+    return _shared_limiter
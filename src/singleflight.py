@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import json
+
+from src.logger import logging
+from src.metrics import REGISTRY, Counter
+
+COALESCED_CALLS = REGISTRY.register(Counter("analysis_singleflight_coalesced_total", "Calls that joined an identical call already in flight.", ("namespace",)))
+
+
+def request_key(*parts):
+    """
+    Computes a key for a call from its JSON serializable arguments, keeping their order.
+
+    Args:
+        *parts: The arguments of the call.
+
+    Returns:
+        str: The hex digest of the arguments.
+    """
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls that are in flight at the same time: the first call runs, and every call with the same
+    key made before it finishes waits for the same future and gets the same result or exception. Nothing is kept once
+    the call finishes, so this only removes duplicate work during bursts and is not a cache.
+    """
+    def __init__(self, namespace: str):
+        """
+        Initializes the group.
+
+        Args:
+            namespace (str): The name of the group in logs and metrics.
+        """
+        self.namespace = namespace
+        self._calls = {}
+
+    async def do(self, key: str, function, *args):
+        """
+        Runs `function(*args)` unless a call with the same key is in flight, in which case waits for that call.
+
+        Args:
+            key (str): The key identifying identical calls.
+            function: The coroutine function to call.
+            *args: The arguments of the call.
+
+        Returns:
+            The result of the call.
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(function(*args))
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            logging.info(f"Joining {self.namespace} call already in flight")
+            COALESCED_CALLS.inc(self.namespace)
+
+        #A waiter that gets cancelled must not cancel the call the other waiters share
+        return await asyncio.shield(future)
+
+    def _forget(self, key: str, future):
+        """
+        Removes a finished call so the next call with its key runs again.
+        """
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        #Mark the exception as retrieved in case every waiter was cancelled
+        if not future.cancelled():
+            future.exception()
@@ -2,6 +2,9 @@ import os
 import re
 import openai
 from src.logger import logging
+from src.llm_client import get_llm_pool
+from src.singleflight import SingleFlight, request_key
+from src.utils import count_tokens
 from src.summarizer.summarizer_prompts import map_prompt, reduce_prompt
 
 from langchain.embeddings.openai import OpenAIEmbeddings
@@ -33,6 +36,8 @@ class Summarizer:
         """
         self.debug = user_settings["debug"]
         self._reduction_max_tokens = 4000
+        self._llm_pool = get_llm_pool(user_settings)
+        self._in_flight = SingleFlight("summarization")
         self.connect_to_llm(user_settings["openAI_model_name"])
         self.define_summary_text_splitter()
         self._initialize_summarizer()
@@ -46,7 +51,7 @@ class Summarizer:
         """
         logging.info("Establishing connection to open ai models for summarization")
         try: 
-            self._llm = ChatOpenAI(model_name= model_name, temperature=0)
+            self._llm = self._llm_pool.get("summarizer", "map", model_name=model_name)
             self._embedding_llm = OpenAIEmbeddings(
                             model="text-embedding-ada-002",
                         )
@@ -64,8 +69,9 @@ class Summarizer:
         """
         Defines text splitter for when we are splitting to store into the vector database
         """
-        self._sum_text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-                                chunk_size=8000, chunk_overlap=0.5
+        #Same gpt2 token counts as from_tiktoken_encoder, but count_tokens falls back to an estimate offline
+        self._sum_text_splitter = RecursiveCharacterTextSplitter(
+                                chunk_size=8000, chunk_overlap=0.5, length_function=lambda text: count_tokens(text, "gpt2")
                             )
 
     def _initialize_summarizer(self):
@@ -77,7 +83,7 @@ class Summarizer:
             map_chain = LLMChain(llm=self._llm, prompt=map_prompt)
 
             # Run chain
-            reduce_chain = LLMChain(llm=self._llm, prompt=reduce_prompt)
+            reduce_chain = LLMChain(llm=self._llm_pool.get("summarizer", "reduce"), prompt=reduce_prompt)
 
             # Takes a list of documents, combines them into a single string, and passes this to an LLMChain
             combine_documents_chain = StuffDocumentsChain(
@@ -137,7 +143,7 @@ class Summarizer:
 
         return cleaned_text
 
-    def _summarize(self, text: str, company_name: str, keywords: list):
+    async def _summarize(self, text: str, company_name: str, keywords: list):
         """
         Summarizes the given split documents for a specified company.
 
@@ -149,29 +155,39 @@ class Summarizer:
             The summarized content.
         """
         logging.info("Summarizing content")
-        try:
-            information_to_extract = self._create_content_extraction_list(company_name, keywords)
-            split_documents = self._sum_text_splitter.create_documents([text])
-            for idx in range(len(split_documents)):
-                split_documents[idx].metadata['company_name'] = company_name
-            return self._map_reduce_chain.run(input_documents=split_documents, company_name = company_name, information_to_extract = information_to_extract)
-        except Exception as excep:
-            logging.error(f"Error summarizing content {excep}")
+        information_to_extract = self._create_content_extraction_list(company_name, keywords)
+        split_documents = self._sum_text_splitter.create_documents([text])
+        for idx in range(len(split_documents)):
+            split_documents[idx].metadata['company_name'] = company_name
+        return await self._map_reduce_chain.arun(input_documents=split_documents, company_name = company_name, information_to_extract = information_to_extract)
 
-    async def process(self, text, company_name, keywords):
+    async def process(self, text, company_name, keywords, raise_errors: bool = False):
         """
-        Preprocesses, summarizes, the given text
+        Preprocesses, summarizes, the given text. Concurrent requests with the same text, company and keywords share
+        one summary.
         Args:
             text (str): The text content representing the scraped data.
             company: The company associated with the text.
+            raise_errors (bool): Raise errors instead of logging them and returning None, for callers that retry.
 
         Returns:
             A tuple containing the summarized content and token consumption information.
         """
-        
+        try:
+            return await self._in_flight.do(request_key(text, company_name, keywords), self._process, text, company_name, keywords)
+        except Exception as excep:
+            if raise_errors:
+                raise
+            logging.error(f"Error summarizing content {excep}")
+        return None
+
+    async def _process(self, text, company_name, keywords):
+        """
+        Preprocesses, summarizes, the given text
+        """
         text = self._text_preprocessor(text)
         with get_openai_callback() as cb: 
             logging.info("Summarizing the text for vector database")
-            summarized_content = self._summarize(text, company_name, keywords)
+            summarized_content = await self._summarize(text, company_name, keywords)
             
         return summarized_content
\ No newline at end of file
@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+from src.logger import logging
+
+
+class TranscriptMissError(Exception):
+    """
+    Raised in replay mode when the corpus has no completion for a prompt.
+    """
+
+
+class TranscriptStore:
+    """
+    An on-disk corpus of LLM completions keyed by a hash of their prompt. In record mode every completion returned by
+    the API is appended to the corpus; in replay mode completions are served from the corpus and the API is never
+    called, so a recorded workload can be run again offline, at full speed and with the same outputs.
+
+    The corpus is a gzip compressed JSON lines file, one {"hash", "model", "messages", "stop", "completion",
+    "llm_output"} object per prompt, where messages are [type, content] pairs. The prompts are kept so the corpus can
+    be inspected and a replay miss can be traced to the prompt change behind it. Only the completions are kept in
+    memory.
+    """
+    def __init__(self, path: str, mode: str):
+        """
+        Initializes the store and loads the corpus if it exists.
+
+        Args:
+            path (str): Path of the corpus file.
+            mode (str): "record" or "replay".
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Transcript mode must be record or replay, not {mode}")
+        self.path = path
+        self.mode = mode
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    entry.pop("messages", None)
+                    self._entries.setdefault(entry["hash"], entry)
+        elif mode == "replay":
+            raise FileNotFoundError(f"Transcript corpus {path} does not exist")
+        logging.info(f"Loaded {len(self._entries)} LLM transcripts from {path} for {mode}")
+
+    @staticmethod
+    def prompt_hash(model_name: str, messages: list, stop: list = None):
+        """
+        Hashes a prompt together with the model and stop sequences it was sent with.
+
+        Args:
+            model_name (str): The name of the model.
+            messages (list): The langchain messages of the prompt.
+            stop (list): The stop sequences, or None.
+
+        Returns:
+            str: The hex digest of the prompt.
+        """
+        prompt = [model_name, TranscriptStore.prompt_messages(messages), stop]
+        return hashlib.sha256(json.dumps(prompt, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def prompt_messages(messages: list):
+        """
+        Converts the langchain messages of a prompt to the [type, content] pairs that are hashed and stored.
+
+        Args:
+            messages (list): The langchain messages of the prompt.
+
+        Returns:
+            list: The [type, content] pair of every message.
+        """
+        return [[message.type, message.content] for message in messages]
+
+    def get(self, key: str):
+        """
+        Returns the recorded completion of a prompt.
+
+        Args:
+            key (str): The hash of the prompt.
+
+        Returns:
+            dict: The recorded entry.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            raise TranscriptMissError(f"No recorded completion for prompt {key[:12]}")
+        return entry
+
+    def record(self, key: str, model_name: str, messages: list, stop: list, completion: str, llm_output: dict):
+        """
+        Appends a prompt and its completion to the corpus, unless the prompt is already recorded.
+
+        Args:
+            key (str): The hash of the prompt.
+            model_name (str): The name of the model.
+            messages (list): The langchain messages of the prompt.
+            stop (list): The stop sequences, or None.
+            completion (str): The text of the completion.
+            llm_output (dict): The token usage and model name returned with the completion.
+        """
+        entry = {"hash": key, "model": model_name, "messages": self.prompt_messages(messages), "stop": stop,
+                 "completion": completion, "llm_output": llm_output or {}}
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = {name: value for name, value in entry.items() if name != "messages"}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            #Every append adds a gzip member, which gzip readers handle as one stream
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
@@ -0,0 +1,207 @@
+"""
+Offline bulk translation of the job titles of a CSV or Parquet contact export.
+
+Reads the export in chunks of rows, translates the titles of every company in a chunk concurrently with Translator,
+and appends every translated chunk to the output with a checkpoint, so memory stays bounded and an interrupted run
+resumes after the last written chunk. The output has every input column plus the translated title column; a CSV
+output is one file and a Parquet output is a directory of one part file per chunk.
+
+Usage:
+    python -m src.translator.bulk_translator contacts.csv translated.csv [--company-column company]
+        [--title-column title] [--output-column translated_title] [--chunk-rows 50000] [--max-concurrent-companies 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from src.logger import logging
+from src.llm_client import get_llm_pool
+from src.translator.translator import Translator
+
+
+def clean_titles(titles: pd.Series):
+    """
+    Cleans a column of titles the way Translator._preprocess_titles and Translator._mark_titles clean a list.
+
+    Args:
+        titles (pd.Series): The titles.
+
+    Returns:
+        tuple: The titles without surrounding whitespace, and a mask of the titles that are not empty and have a
+            letter, which are the ones to translate.
+    """
+    cleaned = titles.fillna("").astype(str).str.strip("\n").str.strip()
+    translatable = cleaned.str.len().gt(0) & cleaned.str.contains(r"[^\W\d_]", regex=True)
+    return cleaned, translatable
+
+
+def read_chunks(path: str, chunk_rows: int, text_columns: list):
+    """
+    Reads a CSV or Parquet file in chunks of rows. CSV columns are all read as strings so they are written back
+    exactly as they were, while Parquet columns keep their types and only the text columns are turned into strings.
+
+    Args:
+        path (str): The path of the file. Files ending in .parquet are read as Parquet, the others as CSV.
+        chunk_rows (int): The number of rows per chunk.
+        text_columns (list): The columns read as strings, with missing values as empty strings.
+
+    Returns:
+        generator: The chunks as DataFrames.
+    """
+    if path.endswith(".parquet"):
+        #Parquet support is optional, it needs pyarrow
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            chunk = batch.to_pandas()
+            chunk[text_columns] = chunk[text_columns].fillna("").astype(str)
+            yield chunk
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False)
+
+
+class BulkTranslator:
+    """
+    This class translates the job titles of large contact exports, grouping the titles of every chunk of rows by
+    company and translating the companies concurrently.
+    """
+    def __init__(self, user_settings: dict):
+        """
+        Initializes the BulkTranslator object.
+
+        Args:
+            user_settings (dict): A dictionary containing user settings, including the OpenAI model name.
+        """
+        self._translator = Translator(user_settings)
+        self.chunk_rows = user_settings.get("bulk_chunk_rows", 50000)
+        self.max_concurrent_companies = user_settings.get("bulk_max_concurrent_companies", 20)
+
+    async def translate_frame(self, frame: pd.DataFrame, company_column: str, title_column: str):
+        """
+        Translates the titles of a DataFrame, one Translator call per company.
+
+        Args:
+            frame (pd.DataFrame): The rows.
+            company_column (str): The column with the company names.
+            title_column (str): The column with the titles.
+
+        Returns:
+            pd.Series: The translated titles, with the titles that have nothing to translate as they are.
+        """
+        cleaned, translatable = clean_titles(frame[title_column])
+        translated = frame[title_column].fillna("").astype(str).copy()
+        semaphore = asyncio.Semaphore(self.max_concurrent_companies)
+
+        async def translate_company(company_name, company_titles: pd.Series):
+            async with semaphore:
+                translations = await self._translator.translate_preprocessed(str(company_name), company_titles.tolist())
+            translated.loc[company_titles.index] = translations
+
+        groups = cleaned[translatable].groupby(frame.loc[translatable, company_column], sort=False, dropna=False)
+        await asyncio.gather(*(translate_company(company_name, company_titles) for company_name, company_titles in groups))
+        return translated
+
+    async def translate_file(self, input_path: str, output_path: str, company_column: str = "company",
+                             title_column: str = "title", output_column: str = "translated_title"):
+        """
+        Translates the titles of a CSV or Parquet file chunk by chunk. After every chunk, the chunk is written to the
+        output and a checkpoint next to the output records it, so running the same command again after an
+        interruption skips the chunks already written.
+
+        Args:
+            input_path (str): The path of the input file.
+            output_path (str): The path of the output CSV file, or of the output directory if it ends in .parquet.
+            company_column (str): The column with the company names.
+            title_column (str): The column with the titles.
+            output_column (str): The column the translated titles are written to.
+
+        Returns:
+            int: The number of rows written by this run.
+        """
+        checkpoint_path = output_path + ".checkpoint.json"
+        checkpoint = {"input": os.path.abspath(input_path), "chunk_rows": self.chunk_rows, "chunks": 0, "output_size": 0}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved["input"] != checkpoint["input"] or saved["chunk_rows"] != checkpoint["chunk_rows"]:
+                raise ValueError(f"Checkpoint {checkpoint_path} belongs to another input or chunk size, remove it to start over")
+            checkpoint = saved
+            logging.info(f"Resuming bulk translation after {checkpoint['chunks']} chunks")
+
+        parquet_output = output_path.endswith(".parquet")
+        if parquet_output or input_path.endswith(".parquet"):
+            #Fail before translating anything when the optional Parquet support is missing
+            import pyarrow
+        if parquet_output:
+            os.makedirs(output_path, exist_ok=True)
+        elif os.path.exists(output_path):
+            #Drop anything written after the last checkpoint
+            with open(output_path, "r+b") as f:
+                f.truncate(checkpoint["output_size"])
+
+        rows = 0
+        for number, frame in enumerate(read_chunks(input_path, self.chunk_rows, [company_column, title_column])):
+            if number < checkpoint["chunks"]:
+                continue
+            frame[output_column] = await self.translate_frame(frame, company_column, title_column)
+
+            if parquet_output:
+                frame.to_parquet(os.path.join(output_path, f"part-{number:05d}.parquet"), index=False)
+            else:
+                with open(output_path, "a", encoding="utf-8", newline="") as f:
+                    frame.to_csv(f, header=(number == 0), index=False)
+                checkpoint["output_size"] = os.path.getsize(output_path)
+            checkpoint["chunks"] = number + 1
+            self._save_checkpoint(checkpoint_path, checkpoint)
+
+            rows += len(frame)
+            logging.info(f"Translated chunk {number + 1} ({rows} rows in this run), translation memory {self._translator.memory_stats()}")
+        return rows
+
+    def _save_checkpoint(self, checkpoint_path: str, checkpoint: dict):
+        """
+        Writes the checkpoint to a temporary file first and then replaces the old one, so a checkpoint is never
+        half written.
+        """
+        temporary_path = checkpoint_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(temporary_path, checkpoint_path)
+
+
+async def run(args):
+    settings = {
+        "openAI_model_name": args.model,
+        "debug": False,
+        "bulk_chunk_rows": args.chunk_rows,
+        "bulk_max_concurrent_companies": args.max_concurrent_companies,
+    }
+    try:
+        bulk_translator = BulkTranslator(settings)
+        return await bulk_translator.translate_file(args.input, args.output, args.company_column, args.title_column, args.output_column)
+    finally:
+        await get_llm_pool(settings).close()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--company-column", default="company")
+    parser.add_argument("--title-column", default="title")
+    parser.add_argument("--output-column", default="translated_title")
+    parser.add_argument("--chunk-rows", type=int, default=50000)
+    parser.add_argument("--max-concurrent-companies", type=int, default=20)
+    parser.add_argument("--model", default="gpt-3.5-turbo-1106")
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args))
+    print(f"{rows} rows translated to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
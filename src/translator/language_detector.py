@@ -0,0 +1,102 @@
+import math
+import os
+import re
+from collections import Counter
+
+from src.logger import logging
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "data", "language_samples")
+
+
+class LanguageDetector:
+    """
+    Identifies the language of short texts such as job titles offline, with a naive Bayes model over the character
+    1 to 3-grams of their words. The model is trained when the detector is created from the samples bundled in
+    data/language_samples, one file per language named by its ISO 639-1 code with one sample per line, so adding a
+    language only takes a new file.
+    """
+    def __init__(self, user_settings: dict, samples_dir: str = SAMPLES_DIR):
+        """
+        Initializes the detector and trains its model.
+
+        Args:
+            user_settings (dict): A dictionary containing user settings, including the English detection threshold.
+            samples_dir (str): The directory of the language samples.
+        """
+        self.threshold = user_settings.get("english_detection_threshold", 0.9)
+        self.max_order = 3
+        self._log_probs = {}
+        self._unseen_log_probs = {}
+        self._train(samples_dir)
+
+    def _ngrams(self, text: str):
+        """
+        Returns the character n-grams of every word of a text, with the words padded by spaces so n-grams at the
+        start and end of words are told apart. Digits and punctuation are ignored.
+        """
+        ngrams = []
+        for word in re.findall(r"[^\W\d_]+", text.lower()):
+            padded = f" {word} "
+            for n in range(1, self.max_order + 1):
+                ngrams.extend(padded[i:i + n] for i in range(len(padded) - n + 1) if padded[i:i + n].strip())
+        return ngrams
+
+    def _train(self, samples_dir: str):
+        """
+        Counts the n-grams of the samples of every language and turns them into smoothed log probabilities.
+        """
+        counts = {}
+        for file_name in sorted(os.listdir(samples_dir)):
+            language, extension = os.path.splitext(file_name)
+            if extension != ".txt":
+                continue
+            with open(os.path.join(samples_dir, file_name), encoding="utf-8") as f:
+                counts[language] = Counter(ngram for line in f for ngram in self._ngrams(line))
+
+        vocabulary_size = len(set().union(*counts.values()))
+        for language, language_counts in counts.items():
+            total = sum(language_counts.values()) + vocabulary_size
+            self._log_probs[language] = {ngram: math.log((count + 1) / total) for ngram, count in language_counts.items()}
+            self._unseen_log_probs[language] = math.log(1 / total)
+        logging.info(f"Trained language detector on {len(counts)} languages")
+
+    def detect(self, text: str):
+        """
+        Identifies the language of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            tuple: The most likely language code and its probability, or (None, 0.0) if the text has no letters.
+        """
+        ngrams = self._ngrams(text)
+        if len(ngrams) == 0:
+            return None, 0.0
+
+        scores = {}
+        for language, log_probs in self._log_probs.items():
+            unseen = self._unseen_log_probs[language]
+            scores[language] = sum(log_probs.get(ngram, unseen) for ngram in ngrams)
+
+        #The n-grams of a word overlap, so their evidence is scaled down to keep short texts from looking certain
+        best = max(scores.values())
+        weights = {language: math.exp((score - best) / self.max_order) for language, score in scores.items()}
+        language = max(weights, key=weights.get)
+        return language, weights[language] / sum(weights.values())
+
+    def is_english(self, text: str):
+        """
+        Checks whether a text is confidently English. Texts with letters outside the ASCII range, such as accented
+        or non-Latin letters, are never English.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            bool: True if the text is English with at least the detection threshold probability.
+        """
+        if any(char.isalpha() and not char.isascii() for char in text):
+            return False
+        language, probability = self.detect(text)
+        return language == "en" and probability >= self.threshold
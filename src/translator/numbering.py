@@ -0,0 +1,37 @@
+import re
+
+
+def number_titles(titles: list, ids: list):
+    """
+    Joins titles into the lines of a translation prompt, each line tagged with the id of its title.
+
+    Args:
+        titles (list): The titles.
+        ids (list): The id of every title.
+
+    Returns:
+        str: One "[id] title" line per title. Whitespace inside titles is collapsed so every title stays on its line.
+    """
+    return "\n".join(f"[{title_id}] {' '.join(title.split())}" for title_id, title in zip(ids, titles))
+
+
+def split_numbered_titles(answer: str, ids: list):
+    """
+    Splits an answer to a numbered translation prompt back into the translation of every id.
+
+    Args:
+        answer (str): The answer of the LLM, with every translation on its own "[id] translation" line.
+        ids (list): The ids that were sent.
+
+    Returns:
+        dict: The translation of every id found in the answer. Ids that were not sent are ignored, an id with an
+            empty line is missing so it gets retried, and the first line of an id repeated in the answer wins.
+    """
+    expected_ids = set(ids)
+    translations = {}
+    #[^\S\n] is whitespace other than a newline, so an empty line never takes the next line as its translation
+    for title_id, translation in re.findall(r"^[^\S\n]*\[(\d+)\][^\S\n]*(.*?)\s*$", answer, re.MULTILINE):
+        title_id = int(title_id)
+        if title_id in expected_ids and title_id not in translations and len(translation) > 0:
+            translations[title_id] = translation
+    return translations
@@ -3,16 +3,17 @@ from langchain.prompts import PromptTemplate
 translation_template = """
 For the company called: {company}
 Given the set of company job titles in different languages delimited by triple backticks, Make sure that all of them are converted to English.
-I want the output as a comma seperated list for python.
+Every line starts with the id of its job title in square brackets, for example: [3] Direttore Commerciale
+Answer with one line per job title that starts with the same id in square brackets followed by the English job title, for example: [3] Sales Director
 If you read a line that is not a job titles then replace it with: <NOT A JOB TITLE> 
-Make sure that the number of translated job titles are the same as the original number of job titles. Hence, do not skip any pharse to translate. 
+Make sure that every id is in the answer. Hence, do not skip any pharse to translate. 
 Only translate the content, never output any extra word. For each line below, just translate it.
 
 ```
 {text}
 ```
 
-Translated titles in a comma seperated list: 
+Translated titles, one per line with their ids: 
 """
 
 input_vars = ["company", "text"]
@@ -3,7 +3,7 @@ import os
 import openai
 load_dotenv()
 from langchain.chat_models import ChatOpenAI
-from src.utils import isCharacterPresent
+from src.utils import isCharacterPresent, count_tokens
 
 
 from langchain.document_loaders import TextLoader
@@ -16,11 +16,26 @@ from langchain.chains import SimpleSequentialChain
 from langchain.schema import SystemMessage
 
 from src.translator.prompts import translation_prompt
-from langchain.output_parsers import CommaSeparatedListOutputParser
+from src.translator.numbering import number_titles, split_numbered_titles
 
 from src.logger import logging
+from src.llm_client import get_llm_pool
+from src.singleflight import SingleFlight, request_key
+from src.cache import SQLiteCache
+from src.translator.language_detector import LanguageDetector
 
 import re
+import asyncio
+
+
+class IncompleteTranslationError(Exception):
+    """
+    Raised when some titles are still untranslated after every retry. Keeps the partial result, with the missing
+    titles as they were, for callers that accept it.
+    """
+    def __init__(self, message: str, translated_titles: list):
+        super().__init__(message)
+        self.translated_titles = translated_titles
 
 class Translator:
     """
@@ -34,6 +49,19 @@ class Translator:
         Parameters:
             user_settings (dict): A dictionary containing user settings, including the OpenAI model name.
         """
+        self._llm_pool = get_llm_pool(user_settings)
+        self.model_name = user_settings["openAI_model_name"]
+        self.chunk_token_budget = user_settings.get("translation_chunk_token_budget", 1000)
+        self.chunk_max_titles = user_settings.get("translation_chunk_max_titles", 100)
+        self.chunk_retries = user_settings.get("translation_chunk_retries", 2)
+        self._in_flight = SingleFlight("translation")
+        #Translations of single titles, shared by every company unless scoped per company
+        self._memory = SQLiteCache(user_settings.get("cache_path", "cache/analysis_cache.sqlite3"), "translation_memory",
+                                   ttl=user_settings.get("translation_memory_ttl", 90 * 24 * 3600),
+                                   max_entries=user_settings.get("translation_memory_max_entries", 500000))
+        self.memory_per_company = user_settings.get("translation_memory_per_company", False)
+        #Titles confidently detected as English are kept as they are instead of being translated
+        self._language_detector = LanguageDetector(user_settings) if user_settings.get("skip_english_titles", True) else None
         self.connect_to_llm(user_settings["openAI_model_name"])
         self._initialize_translation_chain()
 
@@ -47,7 +75,7 @@ class Translator:
 
         logging.info("Establishing connection to open ai models for translation")
         try:
-            self._llm = ChatOpenAI(model_name=model_name, temperature=0)
+            self._llm = self._llm_pool.get("translator", "translation", model_name=model_name)
 
             messages = [
                         SystemMessage(
@@ -66,8 +94,8 @@ class Translator:
         logging.info("Initializing translation chain")
         try:
 
-            output_parser = CommaSeparatedListOutputParser()        
-            self._chain = LLMChain(llm=self._llm, prompt=translation_prompt, output_key = "final_result", output_parser=output_parser, verbose=True)
+            #Titles go in and come out tagged with ids, so translations are matched to titles by id and not by position
+            self._chain = LLMChain(llm=self._llm, prompt=translation_prompt, output_key = "final_result", verbose=True)
         
         except Exception as excep:
             logging.error(f"Error initializing translation chain: {excep}")
@@ -87,7 +115,8 @@ class Translator:
 
     def _preprocess_titles(self, titles: list):
         """
-        Preprocesses the input list of titles by removing empty strings and leading/trailing whitespaces.
+        Preprocesses the input list of titles by removing leading/trailing whitespaces and the titles that are empty or
+        have no letter, so the processed titles line up with the indexes from _mark_titles.
 
         Parameters:
             titles (list): The list of titles to be preprocessed.
@@ -100,14 +129,11 @@ class Translator:
             processed_titles = []
             for i in range(len(titles)):
                 cleaned_title = titles[i].strip("\n").strip()
-                if (len(cleaned_title) > 0):
-                    if isCharacterPresent(cleaned_title):
-                        processed_titles.append(cleaned_title)
-                    else:
-                        processed_titles.append("")
+                if (len(cleaned_title) > 0) and isCharacterPresent(cleaned_title):
+                    processed_titles.append(cleaned_title)
             return processed_titles
         except Exception as excep:
-            logging.error("Error preprocessing titles {excep}")
+            logging.error(f"Error preprocessing titles {excep}")
 
         return []
     
@@ -131,39 +157,248 @@ class Translator:
         
         return titles
 
-    async def translate(self, company_name: str, titles: list):
+    def _normalize_title(self, title: str):
         """
-        Translates the titles of a company from their original language to English.
+        Normalizes the case and whitespace of a title, so occurrences of the same title compare equal.
+
+        Parameters:
+            title (str): The preprocessed title.
+
+        Returns:
+            str: The normalized title.
+        """
+        return " ".join(title.split()).lower()
+
+    def _memory_key(self, company_name: str, title: str):
+        """
+        Builds the translation memory key of a title: the normalized title, prefixed by the normalized company name
+        when the memory is scoped per company.
 
         Parameters:
             company_name (str): The name of the company.
-            titles (list): The list of titles to be translated.
+            title (str): The preprocessed title.
 
         Returns:
-            list: The translated list of titles.
+            str: The translation memory key.
         """
+        key = self._normalize_title(title)
+        if self.memory_per_company:
+            key = " ".join(company_name.split()).lower() + "\n" + key
+        return key
 
-        logging.info("Translating titles")
-        try:
-            #Store the indexes that has actual words in their position
-            marked_indexes = self._mark_titles(titles)
+    def memory_stats(self):
+        """
+        Returns the hit and miss counters of the translation memory in this process.
+
+        Returns:
+            dict: The number of hits, misses and the hit ratio.
+        """
+        return self._memory.stats()
+
+    async def _translate_with_memory(self, company_name: str, processed_titles: list):
+        """
+        Translates preprocessed titles. Every distinct title is handled once and its result is copied to all of its
+        occurrences: titles detected as English are kept as they are, and the others are looked up in the translation
+        memory first so only the missing ones are sent to the translation chain, and their translations are stored
+        afterwards.
+
+        Parameters:
+            company_name (str): The name of the company.
+            processed_titles (list): The preprocessed titles.
 
-            #Process all original list and remove empty spaces
-            processed_titles = self._preprocess_titles(titles)
-            if len(processed_titles) == 0:
-                return titles
+        Returns:
+            list: The translated titles, in the order of processed_titles.
 
-            #convert the list of titles into string and send to translation chain
-            str_titles = "\n".join(processed_titles)
-            translated_titles =  self._chain.run({"text":str_titles, "company": company_name})
+        Raises:
+            IncompleteTranslationError: If some titles are still untranslated after every retry.
+        """
+        translated_titles = list(processed_titles)
+
+        #Indexes of the occurrences of every distinct title, in the order the titles first appear
+        occurrences = {}
+        for i, title in enumerate(processed_titles):
+            if len(title) > 0:
+                occurrences.setdefault(self._normalize_title(title), []).append(i)
+
+        lookup_titles = [normalized_title for normalized_title, indexes in occurrences.items()
+                         if self._language_detector is None or not self._language_detector.is_english(processed_titles[indexes[0]])]
+        english_titles = len(occurrences) - len(lookup_titles)
+
+        #Look every title up in one query, off the event loop
+        memory = await asyncio.to_thread(self._memory.get_many, [self._memory_key(company_name, title) for title in lookup_titles])
+        missing_titles = []
+        for normalized_title in lookup_titles:
+            key = self._memory_key(company_name, normalized_title)
+            if key in memory:
+                for i in occurrences[normalized_title]:
+                    translated_titles[i] = memory[key]
+            else:
+                missing_titles.append(normalized_title)
+
+        logging.info(f"{len(occurrences)} distinct titles out of {len(processed_titles)}, {english_titles} in English and "
+                     f"{len(occurrences) - english_titles - len(missing_titles)} answered by translation memory")
+        if len(missing_titles) == 0:
+            return translated_titles
+
+        #Translate the first occurrence of every missing title, in chunks that are translated concurrently
+        chunks = self._chunk_titles([processed_titles[occurrences[title][0]] for title in missing_titles])
+        if len(chunks) > 1:
+            logging.info(f"Splitting {len(missing_titles)} titles into {len(chunks)} chunks")
+        results = await asyncio.gather(*(self._translate_chunk(company_name, chunk) for chunk in chunks))
+
+        untranslated = 0
+        new_translations = {}
+        for chunk, translations in zip(chunks, results):
+            for title, translation in zip(chunk, translations):
+                if translation is None:
+                    untranslated += 1
+                    continue
+                new_translations[self._memory_key(company_name, title)] = translation
+                for i in occurrences[self._normalize_title(title)]:
+                    translated_titles[i] = translation
+        await asyncio.to_thread(self._memory.set_many, new_translations)
+
+        if untranslated > 0:
+            raise IncompleteTranslationError(f"{untranslated} of {len(missing_titles)} titles could not be translated", translated_titles)
+        return translated_titles
+
+    def _chunk_titles(self, titles: list):
+        """
+        Splits titles into chunks that fit the prompt token budget.
 
-            #Add the processed titles to the original list and return the translated information
-            return self._postprocess_titles(titles, translated_titles, marked_indexes)
+        Parameters:
+            titles (list): The titles to be translated.
 
+        Returns:
+            list: The chunks, each a list of at most `chunk_max_titles` titles.
+        """
+        chunks = [[]]
+        tokens = 0
+        for title in titles:
+            title_tokens = count_tokens(title, self.model_name) + 1
+            if len(chunks[-1]) > 0 and (tokens + title_tokens > self.chunk_token_budget or len(chunks[-1]) >= self.chunk_max_titles):
+                chunks.append([])
+                tokens = 0
+            chunks[-1].append(title)
+            tokens += title_tokens
+        return chunks
+
+    async def _translate_chunk(self, company_name: str, titles: list):
+        """
+        Translates a chunk of titles with the translation chain. Every title is sent with an id and every translation
+        is matched back to its title by id, so titles missing from the answer are retried on their own, up to
+        `chunk_retries` times, without translating the others again.
+
+        Parameters:
+            company_name (str): The name of the company.
+            titles (list): The titles of the chunk.
+
+        Returns:
+            list: The translated titles, with None for the titles still missing after every attempt.
+        """
+        translations = {}
+        pending_ids = list(range(1, len(titles) + 1))
+        for attempt in range(1 + self.chunk_retries):
+            try:
+                str_titles = number_titles([titles[title_id - 1] for title_id in pending_ids], pending_ids)
+                answer = await self._chain.arun({"text":str_titles, "company": company_name})
+                translations.update(split_numbered_titles(answer, pending_ids))
+            except Exception as excep:
+                logging.warning(f"Error translating {len(pending_ids)} titles on attempt {attempt + 1}: {excep}")
+
+            pending_ids = [title_id for title_id in pending_ids if title_id not in translations]
+            if len(pending_ids) == 0:
+                break
+            logging.warning(f"{len(pending_ids)} of {len(titles)} titles missing from the translation on attempt {attempt + 1}")
+
+        if len(pending_ids) > 0:
+            logging.error(f"Keeping {len(pending_ids)} titles untranslated after {1 + self.chunk_retries} attempts")
+        return [translations.get(title_id) for title_id in range(1, len(titles) + 1)]
+
+    async def translate_preprocessed(self, company_name: str, processed_titles: list):
+        """
+        Translates titles that are already preprocessed, for callers that clean titles themselves such as the bulk
+        translator. Titles that could not be translated are returned as they are.
+
+        Parameters:
+            company_name (str): The name of the company.
+            processed_titles (list): The preprocessed titles, none of them empty.
+
+        Returns:
+            list: The translated titles, in the order of processed_titles.
+        """
+        logging.info("Translating preprocessed titles")
+        try:
+            return await self._translate_with_memory(company_name, processed_titles)
+        except IncompleteTranslationError as excep:
+            logging.error(f"Error while translating titles: {excep}")
+            return excep.translated_titles
         except Exception as excep:
+            logging.error(f"Error while translating titles: {excep}")
+            return list(processed_titles)
+
+    async def translate(self, company_name: str, titles: list, raise_errors: bool = False):
+        """
+        Translates the titles of a company from their original language to English. Concurrent requests with the
+        same company and titles share one translation.
+
+        Parameters:
+            company_name (str): The name of the company.
+            titles (list): The list of titles to be translated.
+            raise_errors (bool): Raise errors, including titles left untranslated, instead of logging them and
+                returning the titles that could not be translated as they are, for callers that retry.
+
+        Returns:
+            list: The translated list of titles.
+        """
+        try:
+            translated_titles = await self._in_flight.do(request_key(company_name, titles), self._translate, company_name, titles)
+        except IncompleteTranslationError as excep:
+            if raise_errors:
+                raise
+            logging.error(f"Error while translating titles: {excep}")
+            translated_titles = excep.translated_titles
+        except Exception as excep:
+            if raise_errors:
+                raise
             logging.error(f"Error while translating emails: {excep}")
+            translated_titles = titles
+        #Every caller gets its own list since the result is shared
+        return list(translated_titles)
+
+    async def _translate(self, company_name: str, titles: list):
+        """
+        Translates the titles of a company from their original language to English.
+
+        Parameters:
+            company_name (str): The name of the company.
+            titles (list): The list of titles to be translated.
+
+        Returns:
+            list: The translated list of titles.
+        """
+
+        logging.info("Translating titles")
+
+        #Store the indexes that has actual words in their position
+        marked_indexes = self._mark_titles(titles)
+
+        #Process all original list and remove empty spaces
+        processed_titles = self._preprocess_titles(titles)
+        if len(processed_titles) == 0:
             return titles
 
+        #Translate the titles the translation memory does not know yet
+        try:
+            translated_titles = await self._translate_with_memory(company_name, processed_titles)
+        except IncompleteTranslationError as excep:
+            #Map the partial result back as well, for callers that accept it
+            excep.translated_titles = self._postprocess_titles(list(titles), excep.translated_titles, marked_indexes)
+            raise
+
+        #Add the processed titles to the original list and return the translated information
+        return self._postprocess_titles(titles, translated_titles, marked_indexes)
+
 
 
 
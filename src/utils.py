@@ -3,6 +3,7 @@ import sys
 import pandas as pd
 import re
 import json
+import tiktoken
 
 def connect_to_token_df():
 
@@ -23,7 +24,6 @@ def connect_to_token_df():
     return df
 
 def isCharacterPresent(string):
-    string = "ALFA ACCIAI S.P.A."
     for char in string:
         if char.isalpha():
             return True
@@ -68,3 +68,24 @@ async def extract_information(text, keywords):
             information[key] = content
     return information
 
+
+_encodings = {}
+
+def count_tokens(text: str, model_name: str = "gpt-3.5-turbo"):
+    """
+    Counts the tokens of a text with the tiktoken encoding of the model. If the encoding cannot be loaded
+    (e.g. no network access to download it), falls back to an estimate of 4 characters per token.
+    """
+    if model_name not in _encodings:
+        try:
+            try:
+                _encodings[model_name] = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                _encodings[model_name] = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encodings[model_name] = None
+
+    encoding = _encodings[model_name]
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))